@@ -0,0 +1,118 @@
+try:
+    import ujson as json
+except ImportError:
+    import json
+import uTKinter as tk
+from log import log
+
+LAYOUT='layout.json' #the page tree, see tk.Layout
+version=tk.Var(0, t=int) #of the light states the controller has, see update_all
+
+
+def commands(root, pub):
+    #the command factories of the layout: [name, args...] -> callable(var)
+    return {
+        'publish': lambda topic: lambda x: pub.publish(topic, str(x.val)),
+        'switch': lambda topic: lambda x: pub.publish(topic, 'on' if x.val else 'off', key=topic+'/on'),
+        'backlight': lambda: lambda x: root.backlight(x.val),
+    }
+
+
+def read_layout(path=LAYOUT):
+    with open(path) as f:
+        return f.read()
+
+
+def light_ids(vars):
+    #the lights of a layout, they have the Vars <id>/on and <id>/bri
+    return [int(name.split('/')[0]) for name in vars if name.endswith('/bri')]
+
+
+def build_ui(root, pub, bat, router, path=LAYOUT):
+    #creates the page tree of the layout in path, registers the topics of the lights and of new
+    #layouts (controller/layout, saved to path) with router and publishes with pub
+    #returns the light variables: id -> (on/off Var, brightness Var, topic)
+    lights=dict()
+    ui=tk.Layout(commands(root, pub), router)
+    ui.vars['vbat']=tk.Var(bat.vbat)
+    #drawn by the caller, and the saved layout was checked before it was saved
+    apply_layout(root, ui, lights, read_layout(path), draw=False, check_pages=False)
+    router.route('node-red/lights/+', lambda val,args: light_message(root, lights, pub, val, args[0]))
+    router.route('controller/layout', lambda val,args: apply_layout(root, ui, lights, val, path))
+    return lights
+
+
+def apply_layout(root, ui, lights, spec, path=None, draw=True, check_pages=True):
+    #builds and draws the layout spec (json text), updates lights in place and saves spec to path
+    #an invalid layout is logged and the current one kept, only a layout that was built and drawn is saved
+    try:
+        ui.apply(root, spec, draw, check_pages)
+    except (ValueError, KeyError, TypeError, tk.GuiException) as e:
+        log.exception('layout not applied', e)
+        return False
+    lights.clear()
+    for id in light_ids(ui.vars):
+        log.debug('add light {}', id)
+        lights[id]=(ui.vars['{}/on'.format(id)], ui.vars['{}/bri'.format(id)], 'controller/lights/{}/state'.format(id))
+    if path is not None and spec!=read_layout(path): #spare the flash
+        with open(path, 'w') as f:
+            f.write(spec)
+    return True
+
+
+def state_vars(lights):
+    #the Vars kept over deep sleep (see Tk.save_state): on/off and brightness of every light
+    #and the version of these states, so the next sync is a delta
+    vars={'lights/version':version}
+    for id,light in lights.items():
+        vars['{}/on'.format(id)]=light[0]
+        vars['{}/bri'.format(id)]=light[1]
+    return vars
+
+
+def request_state(mqtt):
+    #asks node-red for the lights changed since version, answered on node-red/lights/all
+    #(all lights for version 0)
+    mqtt.publish('controller/lights/all/state', str(version.val))
+
+
+def light_message(root, lights, pub, val, id):
+    if id=='all':
+        update_all(root, lights, pub, val)
+    else:
+        update_light(lights.get(int(id)), val, pub)
+
+
+def update_all(root, lights, pub, val):
+    #the bulk state {"v": version, "l": {"<id>": [on, brightness], ...}} of all lights, or with
+    #"base": version the delta of the lights changed since base
+    #applied in one batch, so all lights are drawn in one frame
+    msg=json.loads(val)
+    if msg.get('base', version.val)!=version.val:
+        #a delta on a state the controller does not have, ask for the changes since its own
+        log.warning('light states {} are a delta on {}, not on {}', msg['v'], msg['base'], version.val)
+        request_state(pub.mqtt)
+        return
+    with root.batch():
+        for id,state in msg['l'].items():
+            set_light(lights.get(int(id)), state[0], state[1], pub)
+    version.val=msg['v']
+    log.info('light states {} ({} lights)', version.val, len(msg['l']))
+
+
+def update_light(light, val, pub):
+    #the state '<on>/<brightness>' of one light
+    if light is not None and val!='get_state':
+        log.info('update for light {}: {}', light[2], val)
+        val=val.split('/')
+        set_light(light, val[0], val[1], pub)
+
+
+def set_light(light, on, bri, pub):
+    if light is None: #not in the layout
+        return
+    light[0].val=on
+    light[1].val=bri
+    #the echo is the state of the light, no need to send it again
+    pub.ack(light[2], str(light[1].val))
+    pub.ack(light[2]+'/on', 'on' if light[0].val else 'off')
@@ -1,3 +1,4 @@
+from boottime import profile #first, starts the boot clock
 import network
 import machine
 import time
@@ -26,7 +27,7 @@ def connect_wifi():
                 print('.', end='')
                 if sta.isconnected():
                     print('\n')
-                    log.info('connected to wifi {}; ip is {}'.format(pw[0], sta.ifconfig()[0]))
+                    log.info('connected to wifi {}; ip is {}', pw[0], sta.ifconfig()[0])
                     break
                 #todo: check timeout
                 time.sleep(1)
@@ -0,0 +1,56 @@
+# timestamps of the start phases (import, display, first draw, wifi, mqtt, state sync)
+# the clock starts with the first import of this module, which should be the first line of boot.py
+# measure_imports gives the time and heap of importing each module (on the device over the repl,
+# on the host with host.importtime)
+import time
+import gc
+
+
+class BootProfile:
+    def __init__(self):
+        self.start=time.ticks_ms()
+        self.phases=[] #(phase, ms since start)
+
+    def mark(self, phase):
+        #records the first time phase is reached, later marks are ignored (and return False)
+        for p in self.phases:
+            if p[0]==phase:
+                return False
+        self.phases.append((phase, time.ticks_diff(time.ticks_ms(), self.start)))
+        return True
+
+    def report(self):
+        from log import log #not at the top, this module is imported before anything else
+        last=0
+        for phase,ms in self.phases: #warning, the production build strips info
+            log.warning('boot {:<12} {:6d} ms (+{} ms)', phase, ms, ms-last)
+            last=ms
+        return dict(self.phases)
+
+
+def _heap():
+    #allocated bytes, with tracemalloc on the host
+    gc.collect()
+    if hasattr(gc, 'mem_alloc'):
+        return gc.mem_alloc()
+    import tracemalloc
+    return tracemalloc.get_traced_memory()[0]
+
+
+def measure_imports(names):
+    #(module, ms, heap bytes) of importing each module of names that is not imported yet
+    #names are in dependency order, so each module is charged with its own cost only
+    import sys
+    res=[]
+    for name in names:
+        if name in sys.modules:
+            continue
+        before=_heap()
+        t=time.ticks_us()
+        __import__(name)
+        us=time.ticks_diff(time.ticks_us(), t)
+        res.append((name, us/1000, _heap()-before))
+    return res
+
+
+profile=BootProfile()
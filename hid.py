@@ -1,6 +1,7 @@
 from machine import Pin, Timer, UART
 from machine import TouchPad as TouchPadBase
 from math import copysign
+from array import array
 import time
 try: 
     from machine import DEC
@@ -14,13 +15,170 @@ class HidException(Exception):
 
 from log import log
 
+#event types
+EV_PRESS=1
+EV_RELEASE=2
+EV_HOLD=3
+EV_ROTATE=4
+EV_TAG=5
+EV_TAG_REMOVED=6
+EV_TOUCH=7
+
+class EventQueue:
+    # preallocated ring of (type, source, value, timestamp) input events
+    # put() is called from irq and timer handlers and does not allocate, it schedules one
+    # dispatch on the event loop when the queue was empty; the dispatch calls
+    # handle_event(type, value, timestamp) of the sources, so application code (e.g. the gui)
+    # never runs in irq context and nothing runs while there is no input
+    # single producer/consumer: put only moves the tail, the dispatcher only the head
+    def __init__(self, size=32):
+        self.size=size
+        self._type=bytearray(size)
+        self._source=bytearray(size)
+        self._value=array('i', [0]*size)
+        self._time=array('i', [0]*size)
+        self._head=0
+        self._tail=0
+        self.overflow=0
+        self.dispatched=0
+        self.wakeups=0 #scheduled dispatches
+        self.sources=[]
+        self._loop=None
+        self._scheduled=False
+        self._dispatch=self.dispatch #bound once, put schedules it without allocating
+
+    def register(self, source):
+        #returns the source id used with put
+        self.sources.append(source)
+        if self._loop is None:
+            self._loop=asyncio.get_event_loop()
+        return len(self.sources)-1
+
+    def put(self, type, source, value=0):
+        tail=self._tail
+        nxt=(tail+1)%self.size
+        if nxt==self._head: #full, one slot stays empty
+            self.overflow+=1
+            return False
+        self._type[tail]=type
+        self._source[tail]=source
+        self._value[tail]=value
+        self._time[tail]=time.ticks_ms()
+        self._tail=nxt
+        if not self._scheduled:
+            self._scheduled=True
+            self.wakeups+=1
+            self._loop.call_soon(self._dispatch)
+        return True
+
+    def __len__(self):
+        return (self._tail-self._head)%self.size
+
+    def dispatch(self):
+        #handle all queued events
+        self._scheduled=False #events put from now on schedule the next dispatch
+        while self._head!=self._tail:
+            i=self._head
+            type=self._type[i]
+            source=self.sources[self._source[i]]
+            value=self._value[i]
+            t=self._time[i]
+            self._head=(i+1)%self.size
+            self.dispatched+=1
+            try:
+                source.handle_event(type, value, t)
+            except Exception as e:
+                log.exception('handling input event {} failed', e, type)
+
+events=EventQueue() #shared by all input devices unless they get their own queue
+
+
+class _SoftTimer:
+    # a timer on the shared hardware timer (see TimerPool), with init/deinit of machine.Timer
+    __slots__=('pool','period','mode','callback','due')
+
+    def __init__(self, pool):
+        self.pool=pool
+        self.callback=None
+
+    def init(self, period=1000, mode=Timer.PERIODIC, callback=None):
+        self.period=period
+        self.mode=mode
+        self.callback=callback
+        self.due=time.ticks_add(time.ticks_ms(), period)
+        self.pool.start(self)
+
+    def deinit(self):
+        self.pool.stop(self)
+
+
+class TimerPool:
+    # runs the timers of all input devices on one hardware timer ticking every tick_ms while
+    # any of them is running, periods are rounded up to whole ticks
+    def __init__(self, tick_ms=50):
+        self.tick_ms=tick_ms
+        self.timers=[] #running _SoftTimers
+        self.hw=None
+
+    def timer(self):
+        return _SoftTimer(self)
+
+    def start(self, t):
+        if t not in self.timers:
+            self.timers.append(t)
+        if len(self.timers)==1:
+            if self.hw is None:
+                self.hw=_hw_timer()
+            self.hw.init(period=self.tick_ms, mode=Timer.PERIODIC, callback=self._tick)
+
+    def stop(self, t):
+        if t in self.timers:
+            self.timers.remove(t)
+            if not self.timers:
+                self.hw.deinit()
+
+    def _tick(self, hw):
+        now=time.ticks_ms()
+        i=len(self.timers)-1
+        while i>=0: #backwards, callbacks may stop their timer
+            if i<len(self.timers):
+                t=self.timers[i]
+                if time.ticks_diff(now, t.due)>=0:
+                    if t.mode==Timer.PERIODIC:
+                        t.due=time.ticks_add(t.due, t.period)
+                        if time.ticks_diff(now, t.due)>=0: #behind, no catching up
+                            t.due=time.ticks_add(now, t.period)
+                    else:
+                        self.stop(t)
+                    t.callback(t)
+            i-=1
+
+timers=TimerPool()
+
+
+def _hw_timer():
+    timernum=0
+    while timernum<12:
+        try:
+            tm=Timer(timernum)
+            log.info('set timer {}', timernum)
+            return tm
+        except ValueError:
+            timernum+=1
+    raise HidException('failed to set up timer')   
+
+
+def get_timer():
+    #a timer of the shared pool, the esp32 has only a few hardware timers
+    return timers.timer()
+
 #from hid import RotaryEncoder
 #encoder=RotaryEncoder(26,27,lambda val:print(val), 10)
 #loop = asyncio.get_event_loop()
 #loop.run_forever()
 
 class RotaryEncoder( DEC):
-    def __init__(self, clk, dt, cmd=None, freq=4,accel=1):
+    def __init__(self, clk, dt, cmd=None, freq=4,accel=1, queue=None):
         if isinstance(clk,int):
             clk=Pin(clk)
         if isinstance(dt, int):
@@ -30,140 +188,119 @@ class RotaryEncoder( DEC):
         self.freq=freq
         self.cmd=cmd
         self.accel=accel
-        loop = asyncio.get_event_loop()
-        loop.create_task(self._handle_rotary_encoder())
-
-    async def _handle_rotary_encoder(self):
+        self.queue=events if queue is None else queue
+        self.src=self.queue.register(self)
         self.resume()
         self.clear()
-        while True:
-            val=self.count_and_clear()
-            if val!=0:
-                #print(val)
-                #self.touched_widget.add_val(val, self, self.touch_window)
-                if self.accel>1:
-                    val=int(copysign(abs(val)**self.accel,val))
-                if self.cmd is not None:
-                    self.cmd(val)
-            await asyncio.sleep(1/self.freq)              
+        self.tm=get_timer()
+        self.tm.init(period=int(1000/freq), mode=Timer.PERIODIC, callback=self._handle_rotary_encoder)
+
+    def _handle_rotary_encoder(self, timer):
+        val=self.count_and_clear()
+        if val!=0:
+            self.queue.put(EV_ROTATE, self.src, val)
+
+    def handle_event(self, type, val, t):
+        if self.accel>1:
+            val=int(copysign(abs(val)**self.accel,val))
+        if self.cmd is not None:
+            self.cmd(val)
         
 
-#from hid import Button
-#btn=Button(25,lambda hid:print('press'),lambda hid :print('hold'),lambda hid:print('release'),hold_repeat_time=.1)
-class Button():
-    def __init__(self,pin,press_cmd=None, hold_cmd=None, release_cmd=None, active_state=0, hold_time=2,hold_repeat_time=None):
-        if isinstance(pin , int):
-            self.pin=Pin(pin, mode=Pin.IN,pull=Pin.PULL_FLOAT, handler=self._handle_button, trigger=Pin.IRQ_ANYEDGE, debounce=500)
-        else:
-            self.pin=pin
-            self.pin.init(mode=Pin.IN,pull=Pin.PULL_FLOAT, handler=self._handle_button, trigger=Pin.IRQ_ANYEDGE, debounce=500)
+class _Pressable:
+    # press/hold/release handling of Button and TouchPad, runs in the event dispatcher
+    def _init_cmds(self, press_cmd, hold_cmd, release_cmd, hold_time, hold_repeat_time, queue):
         self.press_cmd=press_cmd
         self.hold_cmd=hold_cmd
         self.release_cmd=release_cmd
         self.hold_time=hold_time
         self.hold_repeat_time=hold_repeat_time
-        self.active_state=active_state
-        self.is_active=self.pin.value()==active_state
+        self.queue=events if queue is None else queue
+        self.src=self.queue.register(self)
         if self.hold_cmd is not None:
             self.set_timer()
         else:
-            self.timer=None
-    
+            self.tm=None
+
     def set_timer(self):
-        timernum=0
-        while timernum<12:
-            try:
-                self.tm=Timer(timernum)
-                log.info('set timer {}'.format(timernum))
-                break
-            except ValueError:
-                timernum+=1
-        else: 
-            raise HidException('failed to set up timer')   
+        self.tm=get_timer()
 
-    def _handle_button(self, pin):
-        val=pin.irqvalue()
-        if val==self.active_state and not self.is_active: #pressed   
-              
-            self.is_active=True 
+    def handle_event(self, type, val, t):
+        if type==EV_PRESS:
             if self.press_cmd is not None:
                 self.press_cmd(self)
-            if self.hold_cmd is not None:
+            if self.tm is not None:
                 self.tm.init(period=int(self.hold_time*1000), mode=Timer.ONE_SHOT, callback=self._handle_hold)
-        elif val!=self.active_state and self.is_active: #release
-            self.is_active=False
-            if self.release_cmd is not None:
+        elif type==EV_RELEASE:
+            if self.tm is not None:
                 self.tm.deinit()
+            if self.release_cmd is not None:
                 self.release_cmd(self)
+        elif type==EV_HOLD and self.is_active:
+            self.hold_cmd(self)
 
-    
     def _handle_hold(self, timer):
-        self.tm.deinit()
-        self.hold_cmd(self)
         if self.hold_repeat_time is not None:
-            self.tm.init(period=int(self.hold_repeat_time*1000), mode=Timer.PERIODIC, callback=lambda timer: self.hold_cmd(self))
+            self.tm.init(period=int(self.hold_repeat_time*1000), mode=Timer.PERIODIC, callback=self._handle_hold_repeat)
+        else:
+            self.tm.deinit()
+        self.queue.put(EV_HOLD, self.src)
+
+    def _handle_hold_repeat(self, timer):
+        self.queue.put(EV_HOLD, self.src)
+
+#from hid import Button
+#btn=Button(25,lambda hid:print('press'),lambda hid :print('hold'),lambda hid:print('release'),hold_repeat_time=.1)
+class Button(_Pressable):
+    def __init__(self,pin,press_cmd=None, hold_cmd=None, release_cmd=None, active_state=0, hold_time=2,hold_repeat_time=None, queue=None):
+        if isinstance(pin , int):
+            self.pin=Pin(pin, mode=Pin.IN,pull=Pin.PULL_FLOAT, handler=self._handle_button, trigger=Pin.IRQ_ANYEDGE, debounce=500)
+        else:
+            self.pin=pin
+            self.pin.init(mode=Pin.IN,pull=Pin.PULL_FLOAT, handler=self._handle_button, trigger=Pin.IRQ_ANYEDGE, debounce=500)
+        self.active_state=active_state
+        self.is_active=self.pin.value()==active_state
+        self._init_cmds(press_cmd, hold_cmd, release_cmd, hold_time, hold_repeat_time, queue)
+
+    def _handle_button(self, pin):
+        val=pin.irqvalue()
+        if val==self.active_state and not self.is_active: #pressed   
+            self.is_active=True 
+            self.queue.put(EV_PRESS, self.src)
+        elif val!=self.active_state and self.is_active: #release
+            self.is_active=False
+            self.queue.put(EV_RELEASE, self.src)
+
 #from hid import TouchPad
 #touch=TouchPad(14,lambda hid:print('press'),lambda hid :print('hold'),lambda hid:print('release'),hold_repeat_time=.1)
 #loop = asyncio.get_event_loop()
 #loop.run_forever()
 
-class TouchPad():
-    def __init__(self,pin,press_cmd=None, hold_cmd=None, release_cmd=None, threshold=400, hold_time=2,hold_repeat_time=None, freq=10):
+class TouchPad(_Pressable):
+    def __init__(self,pin,press_cmd=None, hold_cmd=None, release_cmd=None, threshold=400, hold_time=2,hold_repeat_time=None, freq=10, queue=None):
         if isinstance(pin , int):
             pin=Pin(pin)
         else:
             pin.init()
         self.tp=TouchPadBase(pin)
-        self.press_cmd=press_cmd
-        self.hold_cmd=hold_cmd
-        self.release_cmd=release_cmd
-        self.hold_time=int(hold_time*1000)
-        if hold_repeat_time is not None:
-            self.hold_repeat_time_diff=int((hold_repeat_time*1000)-self.hold_time)
-        else:
-            self.hold_repeat_time_diff=None
         self.threshold=threshold
         self.freq=freq
         self.is_active=self.tp.read()<self.threshold
-        if self.is_active:
-            self.pressed_timestamp=time.ticks_ms()
-        else: self.pressed_timestamp=None
-
-        loop = asyncio.get_event_loop()
-        loop.create_task(self._handle_touch())
-
-    
-    async def _handle_touch(self):
-        current_hold_repead_time_diff=0
-        while True:
-            val=self.tp.read()
-            
-            if val<self.threshold :
-                if not self.is_active:
-                    #print(val)
-                    self.pressed_timestamp=time.ticks_ms()
-                    self.is_active=True 
-                    if self.press_cmd is not None:
-                        self.press_cmd(self)
-                elif self.hold_cmd is not None and self.pressed_timestamp is not None:
-                    if time.ticks_diff(time.ticks_ms(),self.pressed_timestamp)>self.hold_time+current_hold_repead_time_diff:
-                        if self.hold_repeat_time_diff is not None:
-                            current_hold_repead_time_diff=self.hold_repeat_time_diff
-                            self.pressed_timestamp=time.ticks_ms()
-                        else:
-                            current_hold_repead_time_diff=0
-                            self.pressed_timestamp=None
-                        self.hold_cmd(self)
-            elif self.is_active: #release
-                self.is_active=False
-                self.pressed_timestamp=None
-                current_hold_repead_time_diff=0
-                if self.release_cmd is not None:
-                    self.release_cmd(self)
-            await asyncio.sleep(1/self.freq)      
+        self._init_cmds(press_cmd, hold_cmd, release_cmd, hold_time, hold_repeat_time, queue)
+        self.sampler=get_timer() #the touch sensor has no irq, sample it with a timer
+        self.sampler.init(period=int(1000/freq), mode=Timer.PERIODIC, callback=self._handle_touch)
+
+    def _handle_touch(self, timer):
+        touched=self.tp.read()<self.threshold
+        if touched and not self.is_active:
+            self.is_active=True 
+            self.queue.put(EV_PRESS, self.src)
+        elif not touched and self.is_active: #release
+            self.is_active=False
+            self.queue.put(EV_RELEASE, self.src)
 
 class RFID:
-    def __init__(self,rx=15,tx=2,freq=1,new_tag_cmd=None, tag_removed_cmd=None):
+    def __init__(self,rx=15,tx=2,freq=1,new_tag_cmd=None, tag_removed_cmd=None, queue=None):
         self.uart=UART(1,tx=tx, rx=rx, baudrate=115200)
         self.uart.init()
         self.uart.write(b'\xAB\xBA\x00\x10\x00\x10')
@@ -174,10 +311,15 @@ class RFID:
         self.tag_removed_cmd=tag_removed_cmd
 
         self.current_id=b''
+        self.removed_id=b''
+        self._ids=[b'']*8 #ids of the queued events, the event value is the index
+        self._n=0
         self.waittime=max(.2,1/freq)
+        self.queue=events if queue is None else queue
+        self.src=self.queue.register(self)
         self.uart.callback(UART.CBTYPE_PATTERN, self.uart_cb, pattern=b'\xcd\xdc')
-        loop = asyncio.get_event_loop()
-        loop.create_task(self.mainloop())
+        self.tm=get_timer() #requests the card id periodically
+        self.tm.init(period=int((self.waittime-.1)*1000), mode=Timer.PERIODIC, callback=self.request)
 
     def uart_cb(self, response):    
         #print('[RFID] {}'.format(' '.join('{:02x}'.format(x) for x in  bytearray(response[2]))))
@@ -185,21 +327,32 @@ class RFID:
         if response[:2]==b'\x00\x81':
             id=response[2:-1]
             if id !=  self.current_id:
-                log.info('new card "{}"'.format(' '.join('{:02x}'.format(x) for x in  id)))
                 self.current_id=id
-                if self.new_tag_cmd is not None:
-                    self.new_tag_cmd(id)
+                self._put(EV_TAG, id)
         elif self.current_id:
-            log.info('card "{}" removed'.format(' '.join('{:02x}'.format(x) for x in  self.current_id)))
-            if self.tag_removed_cmd is not None:
-                    self.tag_removed_cmd(self.current_id)
+            self.removed_id=self.current_id
             self.current_id=b''
-        
+            self._put(EV_TAG_REMOVED, self.removed_id)
+
+    def _put(self, type, id):
+        i=self._n%len(self._ids)
+        self._ids[i]=id
+        self._n+=1
+        self.queue.put(type, self.src, i)
+
+    def handle_event(self, type, val, t):
+        id=self._ids[val] #the id read with this event, current_id may be newer
+        if type==EV_TAG:
+            log.info('new card "{}"', ' '.join('{:02x}'.format(x) for x in  id))
+            if self.new_tag_cmd is not None:
+                self.new_tag_cmd(id)
+        elif type==EV_TAG_REMOVED:
+            log.info('card "{}" removed', ' '.join('{:02x}'.format(x) for x in  id))
+            if self.tag_removed_cmd is not None:
+                    self.tag_removed_cmd(id)
 
-    async def mainloop(self):
-        while True:
-            self.uart.write(b'\xAB\xBA\x00\x10\x00\x10')            
-            await asyncio.sleep(self.waittime-.1)
+    def request(self, timer):
+        self.uart.write(b'\xAB\xBA\x00\x10\x00\x10')            
 
 # 1>. Protocol Header: send (0xAB 0xBA)
 # 2>. Return: (0xCD 0xDC)
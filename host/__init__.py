@@ -0,0 +1,61 @@
+# host (CPython) support for running the controller code without an ESP32
+# install() puts the stand-ins for display, machine, network, uasyncio and micropython
+# on the import path and adds the micropython specific time functions
+# the controller modules are imported from ROOT, or from the directory in CONTROLLER_SRC
+# (e.g. a production build of host.build)
+import os
+import sys
+import time
+
+HERE=os.path.dirname(os.path.abspath(__file__))
+FAKES=os.path.join(HERE, 'fakes')
+ROOT=os.environ.get('CONTROLLER_SRC') or os.path.dirname(HERE)
+
+
+def _ticks_ms():
+    return int(time.monotonic()*1000) & 0x3FFFFFFF
+
+
+def _ticks_us():
+    return int(time.monotonic()*1000000) & 0x3FFFFFFF
+
+
+def _ticks_diff(new, old):
+    return ((new-old+0x20000000) & 0x3FFFFFFF)-0x20000000
+
+
+def _ticks_add(t, delta):
+    return (t+delta) & 0x3FFFFFFF
+
+
+def _sleep_ms(ms):
+    time.sleep(ms/1000)
+
+
+def install():
+    for p in (ROOT, FAKES):
+        if p not in sys.path:
+            sys.path.insert(0, p)
+    time.ticks_ms=_ticks_ms
+    time.ticks_us=_ticks_us
+    time.ticks_diff=_ticks_diff
+    time.ticks_add=_ticks_add
+    time.sleep_ms=_sleep_ms
+
+
+def run(seconds):
+    # let the uasyncio tasks run for some time
+    import uasyncio
+    import asyncio
+    uasyncio.get_event_loop().run_until_complete(asyncio.sleep(seconds))
+
+
+def cancel_tasks():
+    import uasyncio
+    import asyncio
+    loop=uasyncio.get_event_loop()
+    tasks=[t for t in asyncio.all_tasks(loop) if not t.done()]
+    for t in tasks:
+        t.cancel()
+    if tasks:
+        loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
@@ -0,0 +1,319 @@
+# render cost benchmark for uTKinter on the host display stand-in
+# builds the page tree of main.py (layout.json, see app.build_ui) and reports draw calls, pixels written
+# and wall time per scenario, and the log calls made (counted before the level check, so the calls
+# the production build strips show even at the WARNING level of the benchmark)
+# usage: python -m host.bench [--repeat N] [--json]
+import os
+import sys
+import time
+import json
+import host
+host.install()
+
+from log import log, WARNING
+import display
+import network
+import uTKinter as tk
+from utils import Battery
+import app
+from pubsub import Router, Publisher
+
+COUNTED=('setwin', 'clearwin', 'rect', 'circle', 'line', 'text', 'writecmd')
+LOG_METHODS=('debug', 'info', 'warning', 'error', 'critical', 'exception')
+log_calls=[0]
+
+
+def count_log_calls():
+    #wraps the methods of the log instance the controller modules share
+    for name in LOG_METHODS:
+        def counted(*args, f=getattr(log, name)):
+            log_calls[0]+=1
+            return f(*args)
+        setattr(log, name, counted)
+
+
+def make_root(lazy=True):
+    root=tk.Tk()
+    root.lazy_pages=lazy
+    root.init(root.ILI9488, width=240, height=320, 
+        miso=19, mosi=23, clk=18, cs=5, dc=21, tcs=0,rst_pin=22, backl_pin=4, bgr=False,
+        hastouch=root.TOUCH_XPT,backl_on=1, speed=40000000, splash=False, rot=root.LANDSCAPE_FLIP)
+    mqtt=network.mqtt('home_controller', 'mqtt://localhost')
+    lights=app.build_ui(root, Publisher(mqtt), Battery(pin=35), Router(), os.path.join(host.ROOT, 'layout.json'))
+    return root, mqtt, lights
+
+
+def menues(root):
+    top=root.grid_geom.widgets[0]
+    licht=top.pages[0].grid_geom.widgets[0]
+    return top, licht
+
+
+class Scenario:
+    def __init__(self, name, fn, setup=None, teardown=None):
+        self.name=name
+        self.fn=fn
+        self.setup=setup
+        self.teardown=teardown
+
+    def run(self, root, repeat):
+        if self.setup is not None:
+            self.setup(root)
+        root.flush()
+        root.reset_stats()
+        skipped=root.draws_skipped
+        moves=root.touch_moves
+        hits=root.text_cache.hits
+        calls=log_calls[0]
+        t=time.perf_counter()
+        for i in range(repeat):
+            self.fn(root, i)
+        dt=time.perf_counter()-t
+        if self.teardown is not None:
+            self.teardown(root)
+        res={k:root.stats[k]/repeat for k in COUNTED}
+        res['calls']=sum(res.values())
+        res['pixels']=root.stats['pixels']/repeat
+        res['bytes_pushed']=root.stats['bytes_pushed']/repeat
+        res['skipped']=(root.draws_skipped-skipped)/repeat
+        res['moves']=(root.touch_moves-moves)/repeat
+        res['text_hits']=(root.text_cache.hits-hits)/repeat
+        res['log_calls']=(log_calls[0]-calls)/repeat
+        res['ms']=dt*1000/repeat
+        return res
+
+
+def full_redraw(root, i):
+    root.draw()
+
+
+def page_switch(root, i):
+    top,licht=menues(root)
+    top.select_page((top.active+1)%len(top.pages), root, top.win)
+    root.flush()
+
+
+def room_switch(root, i):
+    top,licht=menues(root)
+    licht.select_page((licht.active+1)%len(licht.pages), root, licht.win)
+    root.flush()
+
+
+def show_lights(root):
+    top,licht=menues(root)
+    top.select_page(0, root, top.win)
+    licht.select_page(0, root, licht.win)
+
+
+def var_update(root, i):
+    lights=root.bench_lights
+    lights[4][1].val=i%100
+    root.flush()
+
+
+def var_burst(root, i):
+    #10 updates of all visible lights within one frame
+    lights=root.bench_lights
+    for n in range(10):
+        for id in (4,7,8):
+            lights[id][1].val=(i*10+n)%100
+    root.flush()
+
+
+def first_slider(root):
+    top,licht=menues(root)
+    return next(w for w in licht.pages[licht.active].grid_geom.widgets if isinstance(w, tk.Slider))
+
+
+def slider_drag(root, i):
+    #one touch move event on a light slider, back and forth over the bar
+    s=first_slider(root)
+    x1,y1,x2,y2=s.win
+    step=(i*7)%(2*(x2-x1))
+    x=x1+step if step<x2-x1 else x2-(step-(x2-x1))
+    s.on_move((x,(y1+y2)//2), s.win, root)
+    root.flush()
+
+
+def check_partial(root):
+    #a value change of a visible slider repaints the knob, not the whole slider
+    show_lights(root)
+    root.flush()
+    s=first_slider(root)
+    val=s.value.val
+    s.value.val=30
+    root.flush()
+    root.reset_stats()
+    root.redraw(s)
+    full=root.stats['pixels']
+    root.reset_stats()
+    s.value.val=70
+    root.flush()
+    part=root.stats['pixels']
+    s.value.val=val
+    root.flush()
+    assert 0<part<full/2, 'value change drew {} of {} pixels'.format(part, full)
+
+
+def check_hidden(root):
+    #after a page switch, updates of the lights of the pages hidden with it draw nothing
+    show_lights(root)
+    top,licht=menues(root)
+    top.select_page(1, root, top.win)
+    root.flush()
+    root.reset_stats()
+    for id,light in root.bench_lights.items():
+        light[1].val=(light[1].val+10)%100
+    root.flush()
+    pixels=root.stats['pixels']
+    hidden=[w for w in root.walk(licht) if w.is_visible]
+    show_lights(root)
+    root.flush()
+    assert pixels==0 and not hidden, 'hidden page drew {} pixels, {} widgets visible'.format(pixels, len(hidden))
+
+
+def start_drag(root):
+    #raw touch values are screen coordinates, with 3 pixels of noise per reading
+    show_lights(root)
+    root.set_touch_calibration(matrix=(1,0,0,0,1,0))
+    root.fake_noise=3
+    root.fake_touch=None
+    root.poll_touch()
+
+
+def end_drag(root):
+    root.fake_touch=None
+    root.poll_touch()
+    root.flush()
+    root.set_touch_calibration()
+    root.fake_noise=0
+
+
+def touch_drag(root, i):
+    #one touch poll of a slow drag (1 pixel per poll) along a light slider
+    s=first_slider(root)
+    x1,y1,x2,y2=s.win
+    root.fake_touch=((y1+y2)//2, x1+20+i%(x2-x1-40)) #the controller reports (y,x)
+    root.poll_touch()
+    root.flush()
+
+
+def touch_points(root):
+    #a fixed grid of touch down positions over the whole screen
+    return [(x,y) for y in range(5, root.height, 30) for x in range(5, root.width, 30)]
+
+
+def touch_down(root, i):
+    #hit test of a screen full of touch downs through the hit index
+    for p in touch_points(root):
+        root.on_touch(p, (0,0,root.width,root.height), root)
+
+
+def touch_down_walk(root, i):
+    #the same touch downs dispatched by walking the widget tree
+    for p in touch_points(root):
+        tk.Frame.on_touch(root, p, (0,0,root.width,root.height), root)
+
+
+def compositing(strip_height):
+    def setup(root):
+        show_lights(root)
+        root.set_compositing(strip_height)
+    return setup
+
+
+def direct(root):
+    root.set_compositing(0)
+
+
+class Unfiltered:
+    #touch filtering off: one reading per poll, no dead band, every move is delivered
+    saved=None
+
+    @classmethod
+    def setup(cls, root):
+        start_drag(root)
+        sliders=[w for w in root.walk() if isinstance(w, tk.Slider)]
+        cls.saved=(root.touch_samples, [(w, w.drag_deadband, w.drag_decimate) for w in sliders])
+        root.touch_samples=1
+        for w in sliders:
+            w.drag_deadband=0
+            w.drag_decimate=False
+
+    @classmethod
+    def teardown(cls, root):
+        end_drag(root)
+        root.touch_samples,sliders=cls.saved
+        for w,deadband,decimate in sliders:
+            w.drag_deadband=deadband
+            w.drag_decimate=decimate
+
+
+SCENARIOS=[
+    Scenario('full_redraw', full_redraw),
+    Scenario('page_switch', page_switch),
+    Scenario('room_switch', room_switch, show_lights),
+    Scenario('var_update', var_update, show_lights),
+    Scenario('var_burst', var_burst, show_lights),
+    Scenario('slider_drag', slider_drag, show_lights),
+    Scenario('touch_drag', touch_drag, start_drag, end_drag),
+    Scenario('touch_raw', touch_drag, Unfiltered.setup, Unfiltered.teardown),
+    Scenario('touch_down', touch_down, show_lights),
+    Scenario('touch_walk', touch_down_walk, show_lights),
+    Scenario('full_strip8', full_redraw, compositing(8), direct),
+    Scenario('full_strip32', full_redraw, compositing(32), direct),
+    Scenario('page_strip16', page_switch, compositing(16), direct),
+    Scenario('var_strip16', var_update, compositing(16), direct),
+]
+
+
+def boot(lazy, repeat):
+    #time to the first frame and heap kept by the ui, with pages built when shown or all at start
+    def first_frame():
+        root,mqtt,lights=make_root(lazy)
+        root.draw()
+        root.initiated=0
+        return root
+    t=time.perf_counter()
+    for i in range(repeat):
+        first_frame()
+    dt=time.perf_counter()-t
+    host.cancel_tasks()
+    heap=tk._measure(first_frame)-len(first_frame()._tft_buf) #without the emulated display RAM
+    host.cancel_tasks()
+    return dict(ms=dt*1000/repeat, heap=heap)
+
+
+def main(argv):
+    repeat=20
+    if '--repeat' in argv:
+        repeat=int(argv[argv.index('--repeat')+1])
+    log.setLevel(WARNING)
+    count_log_calls()
+    root,mqtt,lights=make_root()
+    root.bench_lights=lights
+    root.draw()
+    check_partial(root)
+    check_hidden(root)
+    results={}
+    for s in SCENARIOS:
+        results[s.name]=s.run(root, repeat)
+    root.initiated=0
+    host.cancel_tasks()
+    results['boot_lazy']=boot(True, repeat)
+    results['boot_eager']=boot(False, repeat)
+    if '--json' in argv:
+        print(json.dumps(results, indent=1, sort_keys=True))
+        return results
+    cols=('calls',)+COUNTED+('pixels','bytes_pushed','skipped','moves','log_calls','ms')
+    print('{:<13}'.format('scenario')+''.join('{:>10}'.format(c[:10]) for c in cols))
+    for name,r in results.items():
+        if name.startswith('boot_'):
+            print('{:<13}first frame {:.1f} ms, heap {} bytes'.format(name, r['ms'], r['heap']))
+        else:
+            print('{:<13}'.format(name)+''.join('{:>10.1f}'.format(r[c]) for c in cols))
+    return results
+
+
+if __name__=='__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,105 @@
+# in-process mqtt broker for the host stand-ins: network.mqtt clients publish to it (set
+# network.broker) and it delivers to the subscribed clients after latency seconds on the uasyncio loop
+# NodeRedEcho stands in for the node-red flow behind the controller
+import json
+import uasyncio as asyncio
+
+
+def topic_matches(pattern, topic):
+    p=pattern.split('/')
+    t=topic.split('/')
+    for i,level in enumerate(p):
+        if level=='#':
+            return True
+        if i>=len(t) or (level!='+' and level!=t[i]):
+            return False
+    return len(p)==len(t)
+
+
+class Broker:
+    def __init__(self, latency=.001):
+        self.latency=latency #s from publish to delivery
+        self.subscriptions=[] #(pattern, client), clients have fake_receive(topic, payload)
+        self.published=0
+        self.delivered=0
+
+    def subscribe(self, client, pattern):
+        if (pattern, client) not in self.subscriptions:
+            self.subscriptions.append((pattern, client))
+
+    def unsubscribe(self, client, pattern):
+        if (pattern, client) in self.subscriptions:
+            self.subscriptions.remove((pattern, client))
+
+    def publish(self, topic, payload):
+        self.published+=1
+        loop=asyncio.get_event_loop()
+        clients=[]
+        for pattern,client in self.subscriptions:
+            if client not in clients and topic_matches(pattern, topic): #once per client
+                clients.append(client)
+                loop.call_later(self.latency, self._deliver, client, topic, payload)
+
+    def _deliver(self, client, topic, payload):
+        self.delivered+=1
+        client.fake_receive(topic, payload)
+
+
+class NodeRedEcho:
+    # answers a light command on controller/lights/<id>/state (the brightness, or 'on'/'off' from the
+    # switch, see app.commands; also on .../state/on) with the new state of the light on
+    # node-red/lights/<id> ('<on>/<brightness>'), the state request on controller/lights/all/state
+    # (payload: the version the controller has) with the lights changed since on node-red/lights/all
+    # (see app.update_all) and an audio command on audio/cmd/<cmd> with audio/status/<cmd>
+    def __init__(self, broker, lights=(), delay=.003):
+        self.broker=broker
+        self.delay=delay #s processing time of the flow
+        self.state={id:[False, 0] for id in lights}
+        self.version=0 #counts the changes of state
+        self.changed={id:0 for id in lights} #id -> version of its last change
+        self.received=0
+        broker.subscribe(self, 'controller/lights/#')
+        broker.subscribe(self, 'audio/cmd/#')
+
+    def fake_receive(self, topic, payload):
+        self.received+=1
+        asyncio.get_event_loop().call_later(self.delay, self._handle, topic, payload)
+
+    def _handle(self, topic, payload):
+        levels=topic.split('/')
+        if levels[0]=='controller' and levels[1]=='lights':
+            if levels[2]=='all':
+                self.send_all(int(payload) if payload.isdigit() else 0)
+                return
+            id=int(levels[2])
+            if levels[-1]=='on' or payload in ('on', 'off'):
+                self.set(id, on=payload=='on')
+            else:
+                self.set(id, bri=int(payload))
+            self.send(id)
+        elif levels[0]=='audio':
+            self.broker.publish('audio/status/'+levels[2], payload)
+
+    def set(self, id, on=None, bri=None):
+        light=self.state.setdefault(id, [False, 0])
+        if on is not None:
+            light[0]=on
+        if bri is not None:
+            light[1]=bri
+        self.version+=1
+        self.changed[id]=self.version
+
+    def send_all(self, since=0):
+        #the delta since the version of the controller, all lights for 0 or an unknown version
+        if 0<since<=self.version:
+            ids=[id for id,v in self.changed.items() if v>since]
+            msg=dict(v=self.version, base=since)
+        else:
+            ids=list(self.state)
+            msg=dict(v=self.version)
+        msg['l']={str(id):[1 if self.state[id][0] else 0, self.state[id][1]] for id in ids}
+        self.broker.publish('node-red/lights/all', json.dumps(msg, separators=(',', ':')))
+
+    def send(self, id):
+        on,bri=self.state[id]
+        self.broker.publish('node-red/lights/{}'.format(id), '{}/{}'.format('true' if on else 'false', bri))
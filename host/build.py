@@ -0,0 +1,174 @@
+# production build of the controller modules: removes the log calls below a level from the
+# source (the statements become empty lines, so line numbers in tracebacks still match the
+# repository), compiles the result to .mpy with mpy-cross if it is on the PATH and compares
+# size and host.bench results of the build with the source: the log calls made per scenario,
+# which are exact, and the best ms of the rounds with their spread (max-min), which is the noise
+# of the host; a change within the spread is reported as noise, not as a speed difference
+# with --manifest, out/manifest.py freezes the modules (and uasyncio from --lib, e.g. the lib
+# directory upip installed it to) into a firmware, see host.importtime for what that saves at boot
+# on the device, the .mpy files replace the .py files of the same name (boot.py and main.py stay source)
+# usage: python -m host.build [--out DIR] [--strip debug|info] [--no-mpy] [--manifest] [--lib DIR]
+#     [--no-bench] [--repeat N] [--rounds N] [--json]
+import os
+import ast
+import sys
+import json
+import shutil
+import subprocess
+
+HERE=os.path.dirname(os.path.abspath(__file__))
+ROOT=os.path.dirname(HERE)
+LEVELS=('debug', 'info')
+#modules copied to the device, boot.py and main.py included
+MODULES=('app.py', 'boot.py', 'boottime.py', 'hid.py', 'log.py', 'main.py', 'pubsub.py', 'uTKinter.py', 'utils.py', 'wifi.py')
+SCRIPTS=('boot.py', 'main.py') #run by the firmware from the file system, never compiled or frozen
+DATA=('layout.json',) #copied as they are
+
+
+def _is_log_call(stmt, methods):
+    #a statement log.<method>(...)
+    if not isinstance(stmt, ast.Expr) or not isinstance(stmt.value, ast.Call):
+        return False
+    f=stmt.value.func
+    return isinstance(f, ast.Attribute) and f.attr in methods and isinstance(f.value, ast.Name) and f.value.id=='log'
+
+
+def strip(source, methods):
+    #source without the log calls of methods, and the number of removed calls
+    tree=ast.parse(source)
+    lines=source.split('\n')
+    removed=0
+    for node in ast.walk(tree):
+        for field in ('body', 'orelse', 'finalbody'):
+            body=getattr(node, field, None)
+            if not isinstance(body, list) or not body or not isinstance(body[0], ast.stmt):
+                continue
+            calls=[]
+            for i,s in enumerate(body):
+                #statements sharing a line (a; b or if a: b) are left alone
+                alone=(s.lineno!=getattr(node, 'lineno', 0) and (i==0 or body[i-1].end_lineno<s.lineno)
+                    and (i==len(body)-1 or body[i+1].lineno>s.end_lineno))
+                if alone and _is_log_call(s, methods):
+                    calls.append(s)
+            for s in calls:
+                for n in range(s.lineno-1, s.end_lineno):
+                    lines[n]=''
+            if calls and len(calls)==len(body): #the block needs a statement
+                s=calls[0]
+                lines[s.lineno-1]=' '*s.col_offset+'pass'
+            removed+=len(calls)
+    return '\n'.join(lines), removed
+
+
+def build(out, level='info', mpy=True):
+    #writes the stripped modules (and .mpy files) to out, returns a report per module
+    methods=LEVELS[:LEVELS.index(level)+1]
+    mpy_cross=shutil.which('mpy-cross') if mpy else None
+    os.makedirs(out, exist_ok=True)
+    report={}
+    for name in MODULES:
+        with open(os.path.join(ROOT, name)) as f:
+            source=f.read()
+        stripped,removed=strip(source, methods)
+        compile(stripped, name, 'exec') #the build must still be valid python
+        path=os.path.join(out, name)
+        with open(path, 'w') as f:
+            f.write(stripped)
+        r=dict(calls=removed, source=len(source.encode()), stripped=len(stripped.encode()), mpy=None)
+        if mpy_cross and name not in SCRIPTS:
+            subprocess.run([mpy_cross, '-o', path[:-3]+'.mpy', path], check=True)
+            r['mpy']=os.path.getsize(path[:-3]+'.mpy')
+        report[name]=r
+    for name in DATA:
+        shutil.copy(os.path.join(ROOT, name), os.path.join(out, name))
+    return report
+
+
+def manifest(out, lib=None):
+    #writes out/manifest.py, paths in a manifest are relative to its directory
+    modules=tuple(name for name in MODULES if name not in SCRIPTS)
+    path=os.path.join(out, 'manifest.py')
+    with open(path, 'w') as f:
+        f.write('# frozen modules of the controller, written by host.build\n')
+        f.write('# ports with manifests: make FROZEN_MANIFEST={}\n'.format(os.path.abspath(path)))
+        f.write('# loboris firmware: copy the modules to components/micropython/esp32/modules instead\n')
+        f.write('freeze(\'.\', {!r})\n'.format(modules))
+        if lib is not None:
+            f.write('freeze({!r}, \'uasyncio\')\n'.format(os.path.abspath(lib)))
+    return path
+
+
+def bench(src=None, repeat=20):
+    #host.bench results with the modules of src (the repository by default)
+    env=dict(os.environ)
+    env.pop('CONTROLLER_SRC', None)
+    if src is not None:
+        env['CONTROLLER_SRC']=os.path.abspath(src)
+    p=subprocess.run([sys.executable, '-m', 'host.bench', '--json', '--repeat', str(repeat)], cwd=ROOT, env=env,
+        check=True, stdout=subprocess.PIPE, universal_newlines=True)
+    return json.loads(p.stdout[p.stdout.index('{'):])
+
+
+def compare(out, repeat=20, rounds=5):
+    #{scenario: dict(ms=best, spread=max-min, log_calls=n)} of the source and of the build,
+    #benchmarked alternately against drift
+    times=({}, {})
+    calls=({}, {})
+    for i in range(rounds):
+        for k,src in enumerate((None, out)):
+            for name,r in bench(src, repeat).items():
+                times[k].setdefault(name, []).append(r['ms'])
+                calls[k][name]=r.get('log_calls')
+    return tuple({name:dict(ms=min(t), spread=max(t)-min(t), log_calls=calls[k][name]) for name,t in times[k].items()}
+        for k in (0, 1))
+
+
+def main(argv):
+    out=os.path.join(ROOT, 'build')
+    level='info'
+    repeat=20
+    rounds=5
+    if '--out' in argv:
+        out=argv[argv.index('--out')+1]
+    if '--strip' in argv:
+        level=argv[argv.index('--strip')+1]
+    if '--repeat' in argv:
+        repeat=int(argv[argv.index('--repeat')+1])
+    if '--rounds' in argv:
+        rounds=int(argv[argv.index('--rounds')+1])
+    modules=build(out, level, '--no-mpy' not in argv)
+    results=dict(modules=modules)
+    if '--manifest' in argv:
+        results['manifest']=manifest(out, argv[argv.index('--lib')+1] if '--lib' in argv else None)
+    if '--no-bench' not in argv:
+        results['ms_source'],results['ms_build']=compare(out, repeat, rounds)
+    if '--json' in argv:
+        print(json.dumps(results, indent=1, sort_keys=True))
+        return results
+    print('{:<13}{:>8}{:>10}{:>10}{:>10}'.format('module', 'calls', 'source', 'stripped', 'mpy'))
+    for name,r in modules.items():
+        print('{:<13}{:>8}{:>10}{:>10}{:>10}'.format(name, r['calls'], r['source'], r['stripped'], '-' if r['mpy'] is None else r['mpy']))
+    print('{:<13}{:>8}{:>10}{:>10}{:>10}'.format('total', *(sum(r[c] for r in modules.values()) for c in ('calls', 'source', 'stripped')),
+        sum(r['mpy'] or 0 for r in modules.values()) or '-'))
+    if 'manifest' in results:
+        print('manifest     {}'.format(results['manifest']))
+    if 'ms_build' in results:
+        src,bld=results['ms_source'],results['ms_build']
+        print()
+        print('{:<13}{:>12}{:>12}{:>11}{:>9}{:>10}{:>9}{:>9}'.format('scenario', 'source logs', 'build logs', 'source ms',
+            '+-', 'build ms', '+-', 'change'))
+        for name in src:
+            a,b=src[name],bld[name]
+            if a['log_calls'] is None: #boot_*
+                logs=('-', '-')
+            else:
+                logs=('{:.1f}'.format(a['log_calls']), '{:.1f}'.format(b['log_calls']))
+            d=b['ms']-a['ms']
+            change='noise' if abs(d)<=max(a['spread'], b['spread']) or not a['ms'] else '{:.1f}%'.format(d*100/a['ms'])
+            print('{:<13}{:>12}{:>12}{:>11.2f}{:>9.2f}{:>10.2f}{:>9.2f}{:>9}'.format(name, logs[0], logs[1], a['ms'], a['spread'],
+                b['ms'], b['spread'], change))
+    return results
+
+
+if __name__=='__main__':
+    main(sys.argv[1:])
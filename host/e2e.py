@@ -0,0 +1,249 @@
+# end-to-end latency of the controller on the host: runs main.py against the display stand-in
+# and an in-process broker with a node-red stand-in (host.broker), feeds scripted input (touch,
+# rotary encoder, rfid reader) and measures the time from the input to the frame showing the
+# echo of node-red (or to the reply, for the rfid reader)
+# usage: python -m host.e2e [--repeat N] [--latency MS] [--json]
+import os
+import sys
+import json
+import math
+import time
+import runpy
+import shutil
+import tempfile
+import host
+host.install()
+
+import network
+import uasyncio as asyncio
+from host.broker import Broker, NodeRedEcho
+
+MAIN=os.path.join(host.ROOT, 'main.py')
+
+
+def percentile(values, p):
+    #nearest rank
+    if not values:
+        return None
+    values=sorted(values)
+    return values[max(0, math.ceil(p/100*len(values))-1)]
+
+
+def check_percentile():
+    #nearest rank: the smallest value with at least p % of the values at or below it
+    v=list(range(1, 11))
+    assert percentile(v, 50)==5 and percentile(v, 90)==9 and percentile(v, 99)==10 and percentile(v, 100)==10
+    assert percentile(v, 0)==1 and percentile(v, 10)==1 and percentile(v, 11)==2
+    assert percentile([3, 1, 2], 50)==2 and percentile([7], 99)==7 and percentile([], 50) is None
+
+
+class Harness:
+    def __init__(self, latency=.001):
+        self.broker=Broker(latency)
+        network.broker=self.broker
+        network.WLAN.fake_scan=[(b'home', b'\x24\x65\x11\x00\x00\x01', 6, -55, 3, 0)]
+        network.WLAN.fake_connect_ms=50
+        import app
+        self.echo=NodeRedEcho(self.broker, app.light_ids(json.loads(app.read_layout())['vars']))
+        self.arrivals=[] #(time, topic, payload) of the messages received by the controller
+        self.flushes=[] #(time, widgets drawn)
+        self.loop=asyncio.get_event_loop()
+        self.main=self.start_main()
+        self.root=self.main['root']
+
+    def start_main(self):
+        #runs main.py up to root.mainloop(), the harness drives the event loop instead
+        import uTKinter as tk
+        mainloop=tk.Tk.mainloop
+        tk.Tk.mainloop=lambda root: None
+        try:
+            g=runpy.run_path(MAIN, run_name='__main__')
+        finally:
+            tk.Tk.mainloop=mainloop
+        root=g['root']
+        flush=root.flush
+        def timed_flush():
+            n=flush()
+            self.flushes.append((time.perf_counter(), n))
+            return n
+        root.flush=timed_flush
+        return g
+
+    def run(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    async def connected(self, timeout=10):
+        #waits for wifi and mqtt, then hooks into the messages received by the controller
+        mqtt=self.main['mqtt']
+        t=time.perf_counter()
+        while mqtt.data_cb is None or not self.main['outbox'].connected:
+            if time.perf_counter()-t>timeout:
+                raise RuntimeError('no mqtt connection')
+            await asyncio.sleep(.01)
+        data_cb=mqtt.data_cb
+        def timed_data_cb(msg):
+            self.arrivals.append((time.perf_counter(), msg[1], msg[2]))
+            data_cb(msg)
+        mqtt.data_cb=timed_data_cb
+        await asyncio.sleep(.5) #the state sync of the start
+
+    async def measure(self, inject, expect, n=1, redraw=True, timeout=2):
+        #ms from inject() to the first frame after the n-th message matching expect(topic, payload)
+        #(to that message without redraw), None on timeout
+        a=len(self.arrivals)
+        t0=time.perf_counter()
+        inject()
+        while time.perf_counter()-t0<timeout:
+            got=[m for m in self.arrivals[a:] if expect(m[1], m[2])]
+            if len(got)>=n:
+                t1=got[n-1][0]
+                if not redraw:
+                    return (t1-t0)*1000
+                frames=[f for f in self.flushes if f[0]>=t1]
+                if frames:
+                    return (frames[0][0]-t0)*1000
+            await asyncio.sleep(.001)
+        return None
+
+    def stop(self):
+        self.root.initiated=0
+        host.cancel_tasks()
+        network.broker=None
+
+
+def light_slider(h, id):
+    import uTKinter as tk
+    var=h.main['lights'][id][1]
+    return next(w for w in var.widgets if isinstance(w, tk.Slider))
+
+
+async def slider_drag(h, repeat):
+    #touch down on the knob, drag 40 pixels and release, node-red echoes the new brightness
+    root=h.root
+    s=light_slider(h, 4)
+    root.set_touch_calibration(matrix=(1,0,0,0,1,0))
+    res=[]
+    for i in range(repeat):
+        x1,y1,x2,y2=s.win
+        y=(y1+y2)//2
+        start=x1+20+(i%2)*40
+        for x in range(start, start+41-(i%2)*80, 4 if i%2==0 else -4):
+            root.fake_touch=(y, x) #the controller reports (y,x)
+            await asyncio.sleep(.015)
+        value=s.value.val
+        def release():
+            root.fake_touch=None
+        res.append(await h.measure(release, lambda t,p: t=='node-red/lights/4' and p.endswith('/{}'.format(value))))
+        await asyncio.sleep(.3) #publisher rate limit
+    root.set_touch_calibration()
+    return res
+
+
+async def encoder_spin(h, repeat):
+    #5 encoder steps of 2 on the focused slider 50 ms apart, latency of the last step to the echo of the end value
+    root=h.root
+    s=light_slider(h, 7)
+    root.focus_widget=s
+    root.focus_window=s.win
+    encoder=h.main['encoder']
+    res=[]
+    for i in range(repeat):
+        d=2 if i%2==0 else -2
+        value=min(100, max(0, s.value.val+5*d))
+        for n in range(4):
+            encoder.fake_add(d)
+            await asyncio.sleep(.05)
+        res.append(await h.measure(lambda: encoder.fake_add(d), lambda t,p: t=='node-red/lights/7' and p.endswith('/{}'.format(value))))
+        await asyncio.sleep(.3)
+    root.focus_widget=None
+    root.focus_window=None
+    return res
+
+
+async def light_switch(h, repeat):
+    #select on a light slider (the encoder button) switches the light, node-red echoes on/off
+    root=h.root
+    s=light_slider(h, 8)
+    res=[]
+    for i in range(repeat):
+        on='false' if s.is_active.val else 'true'
+        res.append(await h.measure(lambda: s.select(root, s.win), lambda t,p: t=='node-red/lights/8' and p.startswith(on+'/')))
+        await asyncio.sleep(.3) #publisher rate limit
+    return res
+
+
+async def rfid_tag(h, repeat):
+    #a new tag on the reader until the reply of the audio player
+    uart=h.main['rfid'].uart
+    res=[]
+    for i in range(repeat):
+        tag=bytes((0x12, 0x34, i, 0x78))
+        res.append(await h.measure(lambda: uart.fake_receive(b'\x00\x81'+tag+b'\x00'),
+            lambda t,p: t=='audio/status/play', redraw=False))
+        uart.fake_receive(b'\x00\x80\x00') #tag removed
+        await asyncio.sleep(.05)
+    return res
+
+
+async def state_sync(h, repeat):
+    #all lights change in node-red, the state request until the frame after the answer
+    import app
+    outbox=h.main['outbox']
+    res=[]
+    for i in range(repeat):
+        for id,light in h.echo.state.items():
+            h.echo.set(id, not light[0], (light[1]+13)%101)
+        res.append(await h.measure(lambda: app.request_state(outbox), lambda t,p: t=='node-red/lights/all'))
+        await asyncio.sleep(.05)
+    return res
+
+
+SCENARIOS=[('slider_drag', slider_drag), ('encoder_spin', encoder_spin), ('light_switch', light_switch), ('rfid_tag', rfid_tag),
+    ('state_sync', state_sync)]
+
+
+def main(argv):
+    check_percentile()
+    repeat=10
+    latency=1
+    if '--repeat' in argv:
+        repeat=int(argv[argv.index('--repeat')+1])
+    if '--latency' in argv:
+        latency=float(argv[argv.index('--latency')+1])
+    with tempfile.TemporaryDirectory() as d:
+        cwd=os.getcwd()
+        os.chdir(d) #main.py reads and writes its files in the working directory
+        with open('credentials.txt', 'w') as f:
+            f.write('home secret\n')
+        shutil.copy(os.path.join(host.ROOT, 'layout.json'), 'layout.json')
+        from log import log, WARNING
+        log.setLevel(WARNING)
+        h=Harness(latency/1000)
+        try:
+            h.run(h.connected())
+            results={}
+            for name,fn in SCENARIOS:
+                mqtt=h.main['mqtt']
+                sent=len(mqtt.published)
+                received=len(h.arrivals)
+                frames=len(h.flushes)
+                lat=h.run(fn(h, repeat))
+                ok=[v for v in lat if v is not None]
+                results[name]=dict(n=len(lat), timeouts=len(lat)-len(ok), p50=percentile(ok, 50), p90=percentile(ok, 90),
+                    p99=percentile(ok, 99), max=max(ok) if ok else None, sent=len(mqtt.published)-sent,
+                    received=len(h.arrivals)-received, frames=sum(1 for f in h.flushes[frames:] if f[1]))
+        finally:
+            h.stop()
+            os.chdir(cwd)
+    if '--json' in argv:
+        print(json.dumps(results, indent=1, sort_keys=True))
+        return results
+    cols=('n','timeouts','p50','p90','p99','max','sent','received','frames')
+    print('{:<13}'.format('scenario')+''.join('{:>9}'.format(c) for c in cols))
+    for name,r in results.items():
+        print('{:<13}'.format(name)+''.join('{:>9}'.format('-' if r[c] is None else '{:.1f}'.format(r[c]) if isinstance(r[c], float) else r[c]) for c in cols))
+    return results
+
+
+if __name__=='__main__':
+    main(sys.argv[1:])
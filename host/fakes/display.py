@@ -0,0 +1,258 @@
+# host stand-in for the loboris `display` module
+# emulates display.TFT on an in-memory framebuffer (3 bytes per pixel like the ILI9488 over SPI)
+# and counts every drawing call and the pixels written, see TFT.stats
+import random
+
+class TFT:
+    # display types
+    ST7789=0
+    ILI9341=1
+    ILI9488=2
+    ST7735=3
+    GENERIC=4
+    # touch controllers
+    TOUCH_NONE=0
+    TOUCH_XPT=1
+    TOUCH_STMPE=2
+    # orientation
+    PORTRAIT=0
+    LANDSCAPE=1
+    PORTRAIT_FLIP=2
+    LANDSCAPE_FLIP=3
+    # text positions
+    CENTER=-9003
+    RIGHT=-9004
+    BOTTOM=-9004
+    LASTX=7000
+    LASTY=8000
+    # fonts
+    FONT_Default=0
+    FONT_DejaVu18=1
+    FONT_DejaVu24=2
+    FONT_Ubuntu=3
+    FONT_Comic=4
+    FONT_Minya=5
+    FONT_Tooney=6
+    FONT_Small=7
+    FONT_DefaultSmall=8
+    FONT_7seg=9
+
+    _font_sizes={0:(8,12),1:(10,18),2:(14,24),3:(10,16),4:(12,22),5:(12,20),6:(14,24),7:(6,8),8:(6,10),9:(12,24)}
+
+    def __init__(self, *args, **kwargs):
+        self._tft_size=(0,0)
+        self._tft_rot=self.PORTRAIT
+        self._tft_buf=bytearray(0)
+        self._tft_win=(0,0,-1,-1)
+        self._tft_fg=0xFFFFFF
+        self._tft_bg=0x000000
+        self._tft_font=self.FONT_Default
+        self._tft_ramwin=(0,0,0,0)
+        self.fake_touch=None #raw (x,y) of the touch controller, None if not touched
+        self.fake_noise=0 #uniform noise added to each touch reading
+        self._fake_rng=random.Random(0)
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.stats=dict(setwin=0, clearwin=0, rect=0, circle=0, line=0, text=0, pixel=0, readScreen=0, writecmd=0, pixels=0, bytes_pushed=0)
+
+    def init(self, type=None, width=240, height=320, rot=None, hastouch=TOUCH_NONE, **kwargs):
+        self._tft_portrait=(width, height)
+        self._tft_hastouch=hastouch
+        self.orient(self.LANDSCAPE if rot is None else rot)
+        self._tft_buf=bytearray(width*height*3)
+
+    def deinit(self):
+        pass
+
+    def orient(self, rot):
+        self._tft_rot=rot
+        w,h=self._tft_portrait
+        self._tft_size=(h,w) if rot in (self.LANDSCAPE, self.LANDSCAPE_FLIP) else (w,h)
+        self.resetwin()
+
+    def screensize(self):
+        return self._tft_size
+
+    def winsize(self):
+        x1,y1,x2,y2=self._tft_win
+        return (x2-x1+1, y2-y1+1)
+
+    def setwin(self, x1, y1, x2, y2):
+        self.stats['setwin']+=1
+        w,h=self._tft_size
+        self._tft_win=(max(0,int(x1)), max(0,int(y1)), min(w-1,int(x2)), min(h-1,int(y2)))
+
+    def resetwin(self):
+        w,h=self._tft_size
+        self._tft_win=(0,0,w-1,h-1)
+
+    def set_fg(self, color):
+        self._tft_fg=color
+
+    def set_bg(self, color):
+        self._tft_bg=color
+
+    def get_fg(self):
+        return self._tft_fg
+
+    def get_bg(self):
+        return self._tft_bg
+
+    def font(self, font, *args, **kwargs):
+        self._tft_font=font
+
+    def fontSize(self):
+        return self._font_sizes.get(self._tft_font, (8,12))
+
+    def textWidth(self, text):
+        return len(str(text))*self.fontSize()[0]
+
+    # framebuffer primitives, all coordinates absolute and clipped to the window
+    def _fill(self, x1, y1, x2, y2, color):
+        wx1,wy1,wx2,wy2=self._tft_win
+        x1=max(x1,wx1)
+        y1=max(y1,wy1)
+        x2=min(x2,wx2)
+        y2=min(y2,wy2)
+        if x2<x1 or y2<y1:
+            return
+        row=bytes(((color>>16)&0xFF, (color>>8)&0xFF, color&0xFF))*(x2-x1+1)
+        stride=self._tft_size[0]*3
+        for y in range(y1, y2+1):
+            o=y*stride+x1*3
+            self._tft_buf[o:o+len(row)]=row
+        n=(x2-x1+1)*(y2-y1+1)
+        self.stats['pixels']+=n
+        self.stats['bytes_pushed']+=3*n
+
+    def _plot(self, x, y, color):
+        self._fill(x, y, x, y, color)
+
+    def clearwin(self, color=None):
+        self.stats['clearwin']+=1
+        self._fill(*self._tft_win, self._tft_bg if color is None else color)
+
+    def clear(self, color=None):
+        self.resetwin()
+        self.clearwin(color)
+
+    def pixel(self, x, y, color=None):
+        self.stats['pixel']+=1
+        self._plot(self._tft_win[0]+x, self._tft_win[1]+y, self._tft_fg if color is None else color)
+
+    def readPixel(self, x, y):
+        o=((self._tft_win[1]+y)*self._tft_size[0]+self._tft_win[0]+x)*3
+        b=self._tft_buf
+        return (b[o]<<16)|(b[o+1]<<8)|b[o+2]
+
+    def rect(self, x, y, w, h, color=None, fillcolor=None):
+        self.stats['rect']+=1
+        if w<=0 or h<=0:
+            return
+        x+=self._tft_win[0]
+        y+=self._tft_win[1]
+        color=self._tft_fg if color is None else color
+        if fillcolor is not None:
+            self._fill(x, y, x+w-1, y+h-1, fillcolor)
+        self._fill(x, y, x+w-1, y, color)
+        self._fill(x, y+h-1, x+w-1, y+h-1, color)
+        self._fill(x, y, x, y+h-1, color)
+        self._fill(x+w-1, y, x+w-1, y+h-1, color)
+
+    def circle(self, x, y, r, color=None, fillcolor=None):
+        self.stats['circle']+=1
+        x+=self._tft_win[0]
+        y+=self._tft_win[1]
+        color=self._tft_fg if color is None else color
+        for dy in range(-r, r+1):
+            dx=int((r*r-dy*dy)**.5)
+            if fillcolor is not None:
+                self._fill(x-dx, y+dy, x+dx, y+dy, fillcolor)
+            self._plot(x-dx, y+dy, color)
+            self._plot(x+dx, y+dy, color)
+
+    def line(self, x, y, x1, y1, color=None):
+        self.stats['line']+=1
+        ox,oy=self._tft_win[:2]
+        color=self._tft_fg if color is None else color
+        dx=abs(x1-x)
+        dy=-abs(y1-y)
+        sx=1 if x<x1 else -1
+        sy=1 if y<y1 else -1
+        err=dx+dy
+        while True:
+            self._plot(ox+x, oy+y, color)
+            if x==x1 and y==y1:
+                break
+            e2=2*err
+            if e2>=dy:
+                err+=dy
+                x+=sx
+            if e2<=dx:
+                err+=dx
+                y+=sy
+
+    def text(self, x, y, text, color=None, transparent=False, **kwargs):
+        # glyphs are not rasterized, the text box is painted instead
+        self.stats['text']+=1
+        text=str(text)
+        w=self.textWidth(text)
+        h=self.fontSize()[1]
+        ww,wh=self.winsize()
+        if x==self.CENTER:
+            x=(ww-w)//2
+        elif x==self.RIGHT:
+            x=ww-w
+        if y==self.CENTER:
+            y=(wh-h)//2
+        elif y==self.BOTTOM:
+            y=wh-h
+        x+=self._tft_win[0]
+        y+=self._tft_win[1]
+        if not transparent:
+            self._fill(x, y, x+w-1, y+h-1, self._tft_bg)
+        self._fill(x+1, y+h//2, x+w-2, y+h//2, self._tft_fg if color is None else color)
+
+    def readScreen(self, x, y, w, h, buf=None):
+        self.stats['readScreen']+=1
+        if buf is None:
+            buf=bytearray(w*h*3)
+        stride=self._tft_size[0]*3
+        for r in range(h):
+            o=(y+r)*stride+x*3
+            buf[r*w*3:(r+1)*w*3]=self._tft_buf[o:o+w*3]
+        return buf
+
+    def gettouch(self, raw=False):
+        if self.fake_touch is None:
+            return (False, 0, 0)
+        n=self.fake_noise
+        return (True,)+tuple(v+self._fake_rng.randint(-n,n) for v in self.fake_touch)
+
+    # minimal ILI9xxx command emulation: column/page address set and memory write
+    def tft_writecmd(self, cmd):
+        self.stats['writecmd']+=1
+
+    def tft_writecmddata(self, cmd, data):
+        self.stats['writecmd']+=1
+        if cmd==0x2A:
+            x1=(data[0]<<8)|data[1]
+            x2=(data[2]<<8)|data[3]
+            self._tft_ramwin=(x1,self._tft_ramwin[1],x2,self._tft_ramwin[3])
+        elif cmd==0x2B:
+            y1=(data[0]<<8)|data[1]
+            y2=(data[2]<<8)|data[3]
+            self._tft_ramwin=(self._tft_ramwin[0],y1,self._tft_ramwin[2],y2)
+        elif cmd==0x2C:
+            x1,y1,x2,y2=self._tft_ramwin
+            w=x2-x1+1
+            stride=self._tft_size[0]*3
+            for r in range(min(len(data)//(3*w), y2-y1+1)):
+                o=(y1+r)*stride+x1*3
+                self._tft_buf[o:o+3*w]=data[r*3*w:(r+1)*3*w]
+            self.stats['pixels']+=len(data)//3
+            self.stats['bytes_pushed']+=len(data)
+
+    def tft_setspeed(self, speed):
+        pass
@@ -0,0 +1,237 @@
+# host stand-in for the loboris `machine` module
+# peripherals keep their state in plain attributes; fake_* methods let a harness drive inputs
+import time
+import uasyncio as asyncio
+
+DEEPSLEEP_RESET=4
+deepsleep_calls=0
+
+
+def deepsleep(ms=None):
+    global deepsleep_calls
+    deepsleep_calls+=1
+
+
+def reset():
+    pass
+
+
+def reset_cause():
+    return 0
+
+
+def wake_reason():
+    return (0, 0)
+
+
+def freq(*args):
+    return 240000000
+
+
+class Pin:
+    IN=1
+    OUT=3
+    INOUT=5
+    PULL_UP=0
+    PULL_DOWN=1
+    PULL_UPDOWN=2
+    PULL_FLOAT=3
+    IRQ_DISABLE=0
+    IRQ_RISING=1
+    IRQ_FALLING=2
+    IRQ_ANYEDGE=3
+    IRQ_LOLEVEL=4
+    IRQ_HILEVEL=5
+
+    def __init__(self, id, mode=IN, pull=None, value=None, handler=None, trigger=None, debounce=0, acttime=0):
+        self.id=id
+        self._value=1
+        self._irqvalue=1
+        self.init(mode, pull, value, handler, trigger, debounce)
+
+    def init(self, mode=IN, pull=None, value=None, handler=None, trigger=None, debounce=0, acttime=0):
+        self.mode=mode
+        self.handler=handler
+        self.trigger=trigger
+        if value is not None:
+            self._value=value
+
+    def value(self, val=None):
+        if val is None:
+            return self._value
+        self._value=val
+
+    def irqvalue(self):
+        return self._irqvalue
+
+    def fake_set(self, val): #drive the input level and fire the irq handler
+        changed=val!=self._value
+        self._value=val
+        self._irqvalue=val
+        if changed and self.handler is not None:
+            self.handler(self)
+
+
+class SPI:
+    # only constructed by main.py, the display driver has its own spi
+    def __init__(self, *args, **kwargs):
+        pass
+
+
+class PWM:
+    def __init__(self, pin, freq=5000, duty=50, timer=0):
+        self.pin=pin
+        self._duty=duty
+
+    def duty(self, duty=None):
+        if duty is None:
+            return self._duty
+        self._duty=duty
+
+    def deinit(self):
+        pass
+
+
+class ADC:
+    ATTN_0DB=0
+    ATTN_2_5DB=1
+    ATTN_6DB=2
+    ATTN_11DB=3
+
+    def __init__(self, pin):
+        self.pin=pin
+        self.fake_value=2100
+
+    def atten(self, att):
+        pass
+
+    def read(self):
+        return self.fake_value
+
+
+class RTC:
+    _memory=''
+
+    def __init__(self):
+        pass
+
+    def ntp_sync(self, server=None, tz=None, update_period=None):
+        pass
+
+    def synced(self):
+        return True
+
+    def wake_on_ext0(self, pin, level):
+        self.wake_pin=pin
+
+    def write_string(self, s):
+        RTC._memory=s
+
+    def read_string(self):
+        return RTC._memory
+
+
+class DEC:
+    def __init__(self, unit, clk, dt=None):
+        self.unit=unit
+        self._count=0
+        self._paused=False
+
+    def pause(self):
+        self._paused=True
+
+    def resume(self):
+        self._paused=False
+
+    def clear(self):
+        self._count=0
+
+    def count(self):
+        return self._count
+
+    def count_and_clear(self):
+        c=self._count
+        self._count=0
+        return c
+
+    def fake_add(self, n): #simulate encoder steps
+        if not self._paused:
+            self._count+=n
+
+
+class TouchPad:
+    def __init__(self, pin):
+        self.pin=pin
+        self.fake_value=1000
+
+    def read(self):
+        return self.fake_value
+
+
+class Timer:
+    ONE_SHOT=0
+    PERIODIC=1
+    CHRONO=2
+    EXTBASE=3
+
+    def __init__(self, timernum):
+        self.timernum=timernum
+        self._handle=None
+
+    def init(self, period=1000, mode=PERIODIC, callback=None, dbgpin=-1):
+        self.deinit()
+        self.period=period
+        self.mode=mode
+        self.callback=callback
+        self._schedule()
+
+    def _schedule(self):
+        loop=asyncio.get_event_loop()
+        self._handle=loop.call_later(self.period/1000, self._fire)
+
+    def _fire(self):
+        if self.mode==self.PERIODIC:
+            self._schedule()
+        else:
+            self._handle=None
+        if self.callback is not None:
+            self.callback(self)
+
+    def deinit(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle=None
+
+
+class UART:
+    CBTYPE_DATA=1
+    CBTYPE_PATTERN=2
+    CBTYPE_ERROR=3
+
+    def __init__(self, uart_num, tx=None, rx=None, baudrate=115200, **kwargs):
+        self.uart_num=uart_num
+        self.written=[]
+        self._cb=None
+
+    def init(self, *args, **kwargs):
+        pass
+
+    def write(self, data):
+        self.written.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def any(self):
+        return 0
+
+    def read(self, n=-1):
+        return b''
+
+    def callback(self, type, func=None, pattern=None, data_len=None):
+        self._cb=func
+
+    def fake_receive(self, data): #deliver a pattern-terminated frame to the callback
+        if self._cb is not None:
+            self._cb((self.uart_num, self.CBTYPE_PATTERN, bytes(data)))
@@ -0,0 +1,121 @@
+# host stand-in for the loboris `network` module
+import time
+
+STA_IF=0
+AP_IF=1
+
+
+class WLAN:
+    fake_scan=[] #scan() result: (ssid bytes, bssid bytes, channel, rssi, authmode, hidden)
+    fake_reachable=None #ssids connect() succeeds for, None for any
+    fake_connect_ms=0 #time until isconnected() after connect(), plus 1 s with dhcp
+
+    def __init__(self, interface=STA_IF):
+        self._active=False
+        self._connected=None #time.monotonic() when the connection is up
+        self._dhcp=True
+        self._ifconfig=('0.0.0.0', '255.255.255.0', '0.0.0.0', '0.0.0.0')
+
+    def active(self, active=None):
+        if active is None:
+            return self._active
+        self._active=active
+
+    def connect(self, ssid=None, password=None, bssid=None):
+        self.ssid=ssid
+        self.bssid=bssid
+        self._connected=None
+        if self.fake_reachable is None or ssid in self.fake_reachable:
+            self._connected=time.monotonic()+(self.fake_connect_ms+(1000 if self._dhcp else 0))/1000
+            if self._dhcp:
+                self._ifconfig=('192.168.178.50', '255.255.255.0', '192.168.178.1', '192.168.178.1')
+
+    def disconnect(self):
+        self._connected=None
+
+    def isconnected(self):
+        return self._connected is not None and time.monotonic()>=self._connected
+
+    def ifconfig(self, config=None):
+        if config is None:
+            return self._ifconfig
+        self._dhcp=config=='dhcp'
+        if not self._dhcp:
+            self._ifconfig=tuple(config)
+
+    def scan(self):
+        return list(self.fake_scan)
+
+    def config(self, *args, **kwargs):
+        pass
+
+
+class telnet:
+    @staticmethod
+    def start(*args, **kwargs):
+        pass
+
+
+broker=None #in-process broker the clients use (see host.broker), None only records the publishes
+
+
+class mqtt:
+    # records publishes and subscriptions, data is injected with fake_receive (or delivered by broker)
+    def __init__(self, name, server, **kwargs):
+        self.name=name
+        self.server=server
+        self.published=[]
+        self.subscriptions=[]
+        self.data_cb=None
+        self.connected_cb=None
+        self.disconnected_cb=None
+        self.running=False
+        self.config(**kwargs)
+
+    def config(self, data_cb=None, connected_cb=None, disconnected_cb=None, **kwargs):
+        if data_cb is not None:
+            self.data_cb=data_cb
+        if connected_cb is not None:
+            self.connected_cb=connected_cb
+        if disconnected_cb is not None:
+            self.disconnected_cb=disconnected_cb
+
+    def start(self):
+        self.running=True
+        if self.connected_cb is not None:
+            self.connected_cb(self.name)
+
+    def stop(self):
+        self.running=False
+        if self.disconnected_cb is not None:
+            self.disconnected_cb(self.name)
+
+    def free(self):
+        self.running=False
+
+    def status(self):
+        return (2, 'Connected') if self.running else (0, 'Disconnected')
+
+    def subscribe(self, topic):
+        self.subscriptions.append(topic)
+        if broker is not None:
+            broker.subscribe(self, topic)
+        return True
+
+    def unsubscribe(self, topic):
+        self.subscriptions.remove(topic)
+        if broker is not None:
+            broker.unsubscribe(self, topic)
+        return True
+
+    def publish(self, topic, msg):
+        if not self.running:
+            return False
+        self.published.append((topic, msg))
+        if broker is not None:
+            broker.publish(topic, msg)
+        return True
+
+    def fake_receive(self, topic, msg):
+        if self.data_cb is not None:
+            self.data_cb((self.name, topic, msg))
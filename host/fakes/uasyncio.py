@@ -0,0 +1,17 @@
+# host stand-in for uasyncio (v1 api), backed by one asyncio event loop
+import asyncio as _asyncio
+
+sleep=_asyncio.sleep
+_loop=None
+
+
+def sleep_ms(ms):
+    return _asyncio.sleep(ms/1000)
+
+
+def get_event_loop():
+    global _loop
+    if _loop is None:
+        _loop=_asyncio.new_event_loop()
+        _asyncio.set_event_loop(_loop)
+    return _loop
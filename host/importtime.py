@@ -0,0 +1,171 @@
+# import time and heap per module of the controller on the host (boottime.measure_imports in a
+# fresh interpreter per run), imported from source (compiled at every import, like .py files on
+# the device) and precompiled (cached bytecode, like .mpy or frozen modules)
+# the stand-ins of the firmware modules and uasyncio are imported before, they say nothing
+# about the device (there, boottime.measure_imports(('uasyncio',)+ORDER) includes uasyncio),
+# and so are the standard modules the controller modules import (json, binascii, ...): on the
+# device they are built in, so each module is charged with its own code and data only
+# the result is checked against the budget in host/import_budget.json, so startup regressions fail
+# the budget does not hold milliseconds, which depend on the host, but the source import time
+# relative to compiling REF in the same interpreter ('rel'), and the heap in bytes
+# tolerance (see --update): rel 1.5 times the measured value, as the ratio still varies by some
+# 20 % between hosts and runs, and heap 1.2 times, which only changes with the code or the python
+# version; after a python upgrade, or a change that is meant to cost more, run --update
+# usage: python -m host.importtime [--src DIR] [--rounds N] [--update] [--json]
+import os
+import sys
+import json
+import tempfile
+import subprocess
+
+HERE=os.path.dirname(os.path.abspath(__file__))
+ROOT=os.path.dirname(HERE)
+BUDGET=os.path.join(HERE, 'import_budget.json')
+ORDER=('log', 'utils', 'pubsub', 'wifi', 'hid', 'uTKinter', 'app') #dependency order
+FAKES=('uasyncio', 'display', 'machine', 'network', 'micropython')
+#the reference for the import times, python code of the kind of the controller modules
+REF=''.join('''class C{0}:
+    def __init__(self, a, b=None):
+        self.a=a
+        self.b=[a, b, {0}]
+
+    def f(self, x):
+        for i,v in enumerate(self.b):
+            if v is not None and x>i:
+                return dict(i=i, v='{{}}'.format(v))
+        return None
+'''.format(i) for i in range(100))
+
+
+def stdlib():
+    #modules imported by the controller modules which are not part of it
+    import ast
+    names=set()
+    for name in ORDER:
+        with open(os.path.join(os.environ.get('CONTROLLER_SRC', ROOT), name+'.py')) as f:
+            tree=ast.parse(f.read())
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names.update(a.name for a in node.names)
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                names.add(node.module)
+    return sorted(n for n in names if n.split('.')[0] not in ORDER+FAKES)
+
+
+def reference(rounds=5):
+    #best ms of compiling REF
+    import time
+    best=None
+    for i in range(rounds):
+        t=time.perf_counter()
+        compile(REF, 'ref', 'exec')
+        ms=(time.perf_counter()-t)*1000
+        best=ms if best is None else min(best, ms)
+    return best
+
+
+def child(trace):
+    import host
+    host.install()
+    for name in FAKES:
+        __import__(name)
+    for name in stdlib():
+        try:
+            __import__(name)
+        except ImportError: #ujson and the like, the modules fall back to the python names
+            pass
+    import boottime #it only needs time and gc
+    ref=reference()
+    if trace:
+        import tracemalloc
+        tracemalloc.start()
+    print(json.dumps(dict(ref=ref, modules=boottime.measure_imports(ORDER))))
+
+
+def run(src=None, cache=None, trace=False):
+    #{module: (ms, heap)} of one run and the ms of the reference, bytecode cached in cache (None to
+    #compile every module); the heap is only measured with trace, which slows down the imports
+    env=dict(os.environ)
+    env.pop('CONTROLLER_SRC', None)
+    if src is not None:
+        env['CONTROLLER_SRC']=os.path.abspath(src)
+    with tempfile.TemporaryDirectory() as empty:
+        env['PYTHONPYCACHEPREFIX']=cache or empty
+        if cache is None:
+            env['PYTHONDONTWRITEBYTECODE']='1'
+        else:
+            env.pop('PYTHONDONTWRITEBYTECODE', None)
+        p=subprocess.run([sys.executable, '-m', 'host.importtime', '--child']+(['--trace'] if trace else []), cwd=ROOT,
+            env=env, check=True, stdout=subprocess.PIPE, universal_newlines=True)
+    res=json.loads(p.stdout.strip().split('\n')[-1])
+    return {name:(ms, heap) for name,ms,heap in res['modules']}, res['ref']
+
+
+def measure(src=None, rounds=3):
+    #{module: dict(source=ms, compiled=ms, rel=source/reference, heap=bytes)}, best of rounds
+    res={}
+    with tempfile.TemporaryDirectory() as cache:
+        run(src, cache) #writes the bytecode
+        for name,(ms,heap) in run(src, cache, True)[0].items():
+            res[name]=dict(heap=heap)
+        for i in range(rounds):
+            for key,c in (('source', None), ('compiled', cache)):
+                times,ref=run(src, c)
+                for name,(ms,heap) in times.items():
+                    res[name][key]=min(res[name].get(key, ms), ms)
+                    if key=='source':
+                        res[name]['rel']=min(res[name].get('rel', ms/ref), ms/ref)
+    res['total']={k:sum(r[k] for r in res.values()) for k in ('source', 'compiled', 'rel', 'heap')}
+    return res
+
+
+def check(res, budget):
+    #modules over budget as (module, key, value, limit)
+    over=[]
+    for name,limit in budget.items():
+        for key in ('rel', 'heap'):
+            if name in res and key in limit and res[name][key]>limit[key]:
+                over.append((name, key, res[name][key], limit[key]))
+    return over
+
+
+def main(argv):
+    if '--child' in argv:
+        return child('--trace' in argv)
+    src=None
+    rounds=3
+    if '--src' in argv:
+        src=argv[argv.index('--src')+1]
+    if '--rounds' in argv:
+        rounds=int(argv[argv.index('--rounds')+1])
+    res=measure(src, rounds)
+    if '--update' in argv:
+        #see the tolerance above
+        budget={name:dict(rel=round(r['rel']*1.5+.05, 2), heap=int(r['heap']*1.2)) for name,r in res.items()}
+        with open(BUDGET, 'w') as f:
+            f.write(json.dumps(budget, indent=1, sort_keys=True))
+            f.write('\n')
+    try:
+        with open(BUDGET) as f:
+            budget=json.loads(f.read())
+    except OSError:
+        budget={}
+    over=check(res, budget)
+    if '--json' in argv:
+        print(json.dumps(dict(modules=res, over_budget=over), indent=1, sort_keys=True))
+    else:
+        print('{:<10}{:>11}{:>13}{:>8}{:>12}{:>11}{:>13}'.format('module', 'source ms', 'compiled ms', 'rel', 'budget rel',
+            'heap', 'budget heap'))
+        for name,r in res.items():
+            limit=budget.get(name, {})
+            print('{:<10}{:>11.2f}{:>13.2f}{:>8.2f}{:>12}{:>11}{:>13}'.format(name, r['source'], r['compiled'], r['rel'],
+                limit.get('rel', '-'), r['heap'], limit.get('heap', '-')))
+        for name,key,value,limit in over:
+            print('over budget: {} {} {} > {}'.format(name, key, value, limit))
+    if over:
+        sys.exit(1)
+    return res
+
+
+if __name__=='__main__':
+    main(sys.argv[1:])
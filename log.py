@@ -1,12 +1,164 @@
-import logging
-
-log=logging.Logger(__name__)
-log_file=logging.FileHandler('logfile.txt')
-log_console=logging.StreamHandler()
-log_format=logging.Formatter('%(asctime)-15s [%(levelname)s] %(message)s')
-log_file.setFormatter(log_format)
-log_file.setLevel(logging.WARNING)
-log_console.setFormatter(log_format)
-log_console.setLevel(logging.INFO)
-log.addHandler(log_file)
-log.addHandler(log_console)
+# logging for the controller
+# records go to a preallocated ring in RAM (the recent history, see dump), to the console and,
+# written in batches by a background task, to a log file on flash that is rotated at max_size
+# (right away for errors, and when a record for the file would be overwritten in the ring first)
+# messages are str.format templates, the arguments are only formatted if the level is enabled:
+# log.debug('draw {} at {}', widget, win)
+import time
+import os
+import sys
+from array import array
+try:
+    import uasyncio as asyncio
+except ImportError:
+    asyncio=None
+
+DEBUG=10
+INFO=20
+WARNING=30
+ERROR=40
+CRITICAL=50
+_names={DEBUG:'DEBUG', INFO:'INFO', WARNING:'WARNING', ERROR:'ERROR', CRITICAL:'CRITICAL'}
+
+
+class Logger:
+    def __init__(self, name, size=64, path='logfile.txt', max_size=16384, level=INFO, console_level=INFO,
+            file_level=WARNING, flush_interval=10):
+        self.name=name
+        self.size=size
+        self.path=path
+        self.max_size=max_size #bytes, the file is renamed to path+'.1' when it gets bigger
+        self.level=level #records below are dropped without formatting
+        self.console_level=console_level
+        self.file_level=file_level
+        self.flush_interval=flush_interval #s between file writes
+        self._time=array('i', [0]*size)
+        self._level=bytearray(size)
+        self._msg=[None]*size
+        self._seq=0 #number of records so far, the ring index is _seq%size
+        self._written=0 #_seq up to which the file is written
+        self.lost=0 #records for the file overwritten in the ring before they were written (file errors)
+        self.writes=0
+        self._task=False
+
+    def setLevel(self, level):
+        self.level=level
+        self.console_level=max(self.console_level, level)
+
+    def isEnabledFor(self, level):
+        return level>=self.level
+
+    def log(self, level, msg, *args):
+        if level<self.level:
+            return
+        if args:
+            try:
+                msg=msg.format(*args)
+            except Exception as e:
+                msg='{} {} ({})'.format(msg, args, e)
+        i=self._seq%self.size
+        if self.path is not None and self._seq-self.size>=self._written and self._level[i]>=self.file_level:
+            self.flush() #the record in slot i is for the file and not written yet
+            if self._seq-self.size>=self._written:
+                self.lost+=1
+        self._time[i]=int(time.time())
+        self._level[i]=level
+        self._msg[i]=msg
+        self._seq+=1
+        if level>=self.console_level:
+            print(self._line(i))
+        if level>=ERROR:
+            self.flush()
+        elif level>=self.file_level and not self._task:
+            self._start()
+
+    def debug(self, msg, *args):
+        self.log(DEBUG, msg, *args)
+
+    def info(self, msg, *args):
+        self.log(INFO, msg, *args)
+
+    def warning(self, msg, *args):
+        self.log(WARNING, msg, *args)
+
+    def error(self, msg, *args):
+        self.log(ERROR, msg, *args)
+
+    def critical(self, msg, *args):
+        self.log(CRITICAL, msg, *args)
+
+    def exception(self, msg, e, *args):
+        #an error with the exception e
+        self.log(ERROR, msg+': {!r}', *(args+(e,)))
+        if hasattr(sys, 'print_exception'):
+            sys.print_exception(e)
+
+    def _line(self, i):
+        t=time.localtime(self._time[i])
+        return '{}-{:02d}-{:02d} {:02d}:{:02d}:{:02d} [{}] {}'.format(t[0], t[1], t[2], t[3], t[4], t[5],
+            _names.get(self._level[i], self._level[i]), self._msg[i])
+
+    def records(self, n=None, level=DEBUG):
+        #formatted lines of the last n records in the ring (all by default), oldest first
+        first=max(self._seq-self.size, 0 if n is None else self._seq-n, 0)
+        for seq in range(first, self._seq):
+            i=seq%self.size
+            if self._level[i]>=level:
+                yield self._line(i)
+
+    def dump(self, out=print, n=None, level=DEBUG):
+        #passes the recent records to out, e.g. print on the (telnet) repl or an mqtt publish
+        for line in self.records(n, level):
+            out(line)
+
+    def flush(self):
+        #writes the records for the file, called by the background task and before deep sleep
+        if self.path is None or self._written==self._seq:
+            return 0
+        first=max(self._written, self._seq-self.size) #older ones were counted in lost by log()
+        n=0
+        try:
+            with open(self.path, 'a') as f:
+                for seq in range(first, self._seq):
+                    i=seq%self.size
+                    if self._level[i]>=self.file_level:
+                        f.write(self._line(i))
+                        f.write('\n')
+                        n+=1
+            self._written=self._seq
+            self.writes+=1
+            if os.stat(self.path)[6]>self.max_size:
+                self._rotate()
+        except OSError as e:
+            print('log file {} not written: {}'.format(self.path, e))
+        return n
+
+    def _rotate(self):
+        old=self.path+'.1'
+        try:
+            os.remove(old)
+        except OSError:
+            pass
+        os.rename(self.path, old)
+
+    def _start(self):
+        #the file is written by a task of the running event loop, without one right away
+        if asyncio is None:
+            self.flush()
+            return
+        self._task=True
+        asyncio.get_event_loop().create_task(self._writer())
+
+    async def _writer(self):
+        try:
+            while True:
+                await asyncio.sleep(self.flush_interval)
+                self.flush()
+        finally:
+            self._task=False
+
+    def stats(self):
+        return {'records':self._seq, 'pending':self._seq-self._written, 'lost':self.lost, 'writes':self.writes}
+
+
+log=Logger(__name__)
@@ -18,6 +18,11 @@ from utils import Battery
 
 from hid import Button ,TouchPad,RotaryEncoder, RFID
 from log import log
+import app
+from pubsub import Router, Publisher, OfflineQueue
+from boottime import profile
+from wifi import WifiManager
+profile.mark('import')
 
 root = tk.Tk()
 
@@ -25,99 +30,61 @@ root = tk.Tk()
 btn=Button(25,lambda hid:log.info('press'),lambda hid :log.info('hold'),lambda hid :root.cmd_select(),hold_repeat_time=.1)
 encoder=RotaryEncoder(26,27,lambda val: root.cmd_add(val), freq=5)
 root.set_wakeup_pin(25) # to wakeup from deepsleep
+root.page_unload_time=300 #free pages not shown for 5 minutes, they are rebuilt when selected
 
 root.init(root.ILI9488, width=240, height=320, 
     miso=19, mosi=23, clk=18, cs=5, dc=21, tcs=0,rst_pin=22, backl_pin=4, bgr=False,
     hastouch=root.TOUCH_XPT,backl_on=1, speed=40000000, splash=False, rot=root.LANDSCAPE_FLIP)
-
-#info=gui.Frame(root, bg=screen.BLACK, fg=screen.WHITE)
-tk.Label(root, 'Starting wifi...').grid()
 root.backlight(100)
-root.draw()
-connect_wifi()
+profile.mark('display')
 
+#the ui does not need the network, it is painted with the state saved before the last deep sleep
+#(or shutdown) while wifi and mqtt connect
 mqtt = network.mqtt('home_controller', 'mqtt://192.168.178.65')
-mqtt.start()
-
-rooms=[('Wohnzi.',[4,7,8]), ('Schlafzi.',[2,3]), ('Bastelzi.',[1,6])]
-lights=dict()
-
-
-def datacb(msg):
-    log.debug("[{}] Data arrived from topic: {}, Message:\n".format(msg[0], msg[1]), msg[2])
-    topic=msg[1].split('/')
-    if len(topic)==3 and topic[0]=='node-red' and topic[1]=='lights' and msg[2]!='get_state':
-        log.info('update for light {}: {}'.format(topic[2], msg[2]))
-        val=msg[2].split('/')
-        lnr=int(topic[2])
-        if lnr in lights:            
-            lights[lnr][0].val=val[0]#bri
-            lights[lnr][1].val=val[1]#on/off
-
-
-
-root.clear_frame()
-top_menue=tk.Menue(root, 60, side=1)
-top_menue.grid()
-
-licht_page=top_menue.add_page(title='Licht', title_fg=tk.BLACK, title_bg=tk.YELLOW)
-licht_menue=tk.Menue(licht_page, 60, side=0)
-licht_menue.grid()
-
-musik_page=top_menue.add_page(title='Musik', title_fg=tk.WHITE, title_bg=tk.RED)
-musik_frame=tk.Label(musik_page,'hier steuert man die anlage')
-musik_frame.grid()
-
-wetter_page=top_menue.add_page(title='Wetter', title_fg=tk.WHITE, title_bg=tk.BLUE)
-wetter_frame=tk.Label(wetter_page,'bestimmt bald wieder gut')
-wetter_frame.grid()
-
-uhr_page=top_menue.add_page(title='Uhr', title_fg=tk.BLACK, title_bg=tk.GREEN)
-uhr_frame=tk.Clock(uhr_page)
-uhr_frame.grid()
-
-settings_page=top_menue.add_page(title='Settings', title_fg=tk.BLACK, title_bg=tk.YELLOW)
-
+#keeps messages while wifi or the broker are down, survives deep sleep in outbox.txt
+outbox=OfflineQueue(mqtt, size=32, keep_all=('audio/',), path='outbox.txt')
+root.on_shutdown(outbox.save)
 bat=Battery(pin=35, update_interval=600) #send status every 10 minutes
-vbat=tk.Var(bat.vbat)
-bat.vbat=vbat.val
-tk.Label(settings_page, bat.vbat, decoration='Battery: {:.2} Volt').grid(columnspan=3)
-tk.Label(settings_page, 'Hintergrundbeleuchtung').grid(columnspan=3)
-
-bgled=tk.Var(100)
-tk.Slider(settings_page,bgled,min=1, command=lambda x: root.backlight(x.val)).grid(columnspan=2, row=2)
-tk.Label(settings_page,bgled, decoration='{}%').grid(column=2, row=2)
-
-
-foto_page=top_menue.add_page(title='Fotos', title_fg=tk.WHITE, title_bg=tk.RED)
-tk.Label(foto_page, 'Fotos').grid()
-
-for r in rooms:
-    page=licht_menue.add_page(title=r[0], side=0, title_fg=tk.BLACK, title_bg=tk.YELLOW)
-    for row,id in enumerate(r[1]):
-        log.debug('add new light {} in room {}'.format(id, r[0]))
-        #print('deconz/lights/{}/state'.format(id))
-        topic='controller/lights/{}/state'.format(id)
-        #lf=tk.Frame(side=1)
-        #page.pack(lf)
-        lights[id]=(tk.Var(0, t=bool),tk.Var(0, t=int), topic)
-        tk.Label(page, id, decoration='L{}: ').grid(row=row, column=0)
-
-        tk.Slider(page, lights[id][1], lights[id][0],
-            command=lambda x,topic=topic: mqtt.publish(topic, str(x.val)), 
-            select_command=lambda x,topic=topic: mqtt.publish(topic, 'on' if x.val else 'off')
-                ).grid(row=row, column=1, columnspan=4)
-        tk.Label(page, lights[id][1], decoration='{}%').grid(row=row, column=5 )
-
-rfid=RFID(rx=15,tx=2,freq=1,new_tag_cmd=lambda x,topic='audio/cmd/play': mqtt.publish(topic, str(x)), tag_removed_cmd=lambda x,topic='audio/cmd/stop': mqtt.publish(topic, str(x)))
-
-mqtt.config(data_cb=datacb)
-#mqtt.status()
-mqtt.subscribe('node-red/#')
-mqtt.subscribe('audio/#')
-mqtt.subscribe('web/weather')
-
-mqtt.publish('controller/lights/all/state', 'get')
+router=Router()
+pub=Publisher(outbox, min_interval=250)
+#the pages are described in layout.json, a new one can be published to controller/layout
+lights=app.build_ui(root, pub, bat, router)
+root.restore_state(app.state_vars(lights))
+root.on_shutdown(lambda: root.save_state(app.state_vars(lights)))
+root.on_shutdown(log.flush) #the records not yet in the log file
+root.draw()
+profile.mark('first draw')
+
+outbox.on_connect(lambda: profile.mark('mqtt'))
+#the answer to the state request below
+def state_synced(val, args):
+    if profile.mark('state sync'): #only the first sync ends the boot
+        profile.report()
+router.route('node-red/lights/+', state_synced)
+#the recent log records on request, the payload is the number of records (all if empty)
+router.route('controller/log/dump', lambda val,args: log.dump(lambda line: mqtt.publish('controller/log', line), int(val) if val else None))
+
+rfid=RFID(rx=15,tx=2,freq=1,new_tag_cmd=lambda x,topic='audio/cmd/play': outbox.publish(topic, str(x)), tag_removed_cmd=lambda x,topic='audio/cmd/stop': outbox.publish(topic, str(x)))
+
+def network_up():
+    profile.mark('wifi')
+    if router.mqtt is None: #first connection, the mqtt client reconnects by itself later on
+        network.telnet.start()
+        mqtt.start()
+        router.attach(mqtt)
+        #mqtt.status()
+        mqtt.subscribe('audio/#')
+        mqtt.subscribe('web/weather')
+
+#connects in the background, the gui is running meanwhile
+#dhcp: a reused ip config has no lease, see WifiManager
+wifi=WifiManager(fast_timeout=4)
+wifi.on_connect(network_up)
+wifi.prescan() #a scan blocks the loop, without a cached network it is done now
+asyncio.get_event_loop().create_task(wifi.keep_connected())
+
+#the light states changed since the last sync, after every (re)connect
+outbox.on_connect(lambda: app.request_state(outbox))
 #mqtt.publish('deconz/groups/all/state', 'get')
 #mqtt.publish('homecontroller/status/', '1')
 
@@ -0,0 +1,303 @@
+# mqtt helpers: topic routing for incoming messages, rate limited publishing and
+# buffering of outgoing messages while offline
+try:
+    import ujson as json
+except ImportError:
+    import json
+import time
+import uasyncio as asyncio
+from log import log
+
+
+QUEUED=object() #returned by OfflineQueue.publish for a message kept until the next connect
+
+
+def json_payload(payload):
+    return json.loads(payload)
+
+
+class _Node:
+    __slots__=('children','routes')
+
+    def __init__(self):
+        self.children={} #topic level (or '+', '#') -> _Node
+        self.routes=[] #(handler, decode)
+
+
+class Router:
+    # dispatches incoming messages to handlers registered for topic patterns with mqtt wildcards
+    # ('+' matches one level, '#' all remaining levels)
+    # the patterns are stored in a trie, so the cost of a message depends on the topic depth,
+    # not on the number of routes
+    # handlers are called as handler(value, args), value is the payload passed through decode
+    # and args the topic levels matched by the wildcards
+    def __init__(self):
+        self._root=_Node()
+        self.patterns=[]
+        self.mqtt=None
+        self.received=0
+        self.unmatched=0
+
+    def route(self, pattern, handler, decode=None):
+        node=self._root
+        levels=pattern.split('/')
+        for i,level in enumerate(levels):
+            if level=='#' and i!=len(levels)-1:
+                raise ValueError('"#" must be the last level of "{}"'.format(pattern))
+            child=node.children.get(level)
+            if child is None:
+                child=node.children[level]=_Node()
+            node=child
+        node.routes.append((handler, decode))
+        if pattern not in self.patterns:
+            self.patterns.append(pattern)
+            if self.mqtt is not None:
+                self.mqtt.subscribe(pattern)
+
+    def bind(self, pattern, var, decode=None):
+        #sets var.val to the (decoded) payload
+        def set_var(val, args):
+            var.val=val
+        self.route(pattern, set_var, decode)
+
+    def attach(self, mqtt):
+        #subscribe all patterns and receive the messages of the client 
+        self.mqtt=mqtt
+        mqtt.config(data_cb=self.dispatch)
+        for p in self.patterns:
+            mqtt.subscribe(p)
+
+    def _match(self, node, levels, i, args, out):
+        if '#' in node.children:
+            out.append((node.children['#'], args+('/'.join(levels[i:]),)))
+        if i==len(levels):
+            out.append((node, args))
+            return
+        child=node.children.get(levels[i])
+        if child is not None:
+            self._match(child, levels, i+1, args, out)
+        child=node.children.get('+')
+        if child is not None:
+            self._match(child, levels, i+1, args+(levels[i],), out)
+
+    def match(self, topic):
+        #list of (node, args) of all patterns matching topic
+        out=[]
+        self._match(self._root, topic.split('/'), 0, (), out)
+        return out
+
+    def dispatch(self, msg):
+        #data_cb of network.mqtt, msg is (client, topic, payload)
+        topic=msg[1]
+        payload=msg[2]
+        self.received+=1
+        log.debug('[{}] message on {}: {}', msg[0], topic, payload)
+        matched=False
+        for node,args in self.match(topic):
+            for handler,decode in node.routes:
+                matched=True
+                try:
+                    handler(payload if decode is None else decode(payload), args)
+                except Exception as e:
+                    log.exception('handling message on {} failed', e, topic)
+        if not matched:
+            self.unmatched+=1
+
+
+class Publisher:
+    # publishes with at most one message per min_interval (ms) and key (default: the topic)
+    # values published in between replace each other, the last one is sent when the interval is over
+    # a value equal to the last acknowledged one (sent, or reported back with ack) is not sent at all,
+    # a value an OfflineQueue only queued is not acknowledged
+    def __init__(self, mqtt, min_interval=250):
+        self.mqtt=mqtt
+        self._keyed=isinstance(mqtt, OfflineQueue) #the queue merges by key too
+        self.min_interval=min_interval
+        self._pending={} #key -> (topic, payload)
+        self._last={} #key -> ticks_ms of the last publish
+        self._acked={} #key -> last acknowledged payload
+        self._flushing=False
+        self.sent=0
+        self.dropped=0 #replaced by a newer value before being sent
+        self.suppressed=0 #equal to the acknowledged value
+
+    def publish(self, topic, payload, key=None):
+        if key is None:
+            key=topic
+        if key in self._pending:
+            del self._pending[key]
+            self.dropped+=1
+        if self._acked.get(key)==payload:
+            self.suppressed+=1
+            return
+        last=self._last.get(key)
+        if last is None or time.ticks_diff(time.ticks_ms(), last)>=self.min_interval:
+            self._send(key, topic, payload)
+        else:
+            self._pending[key]=(topic, payload)
+            if not self._flushing:
+                self._flushing=True
+                asyncio.get_event_loop().create_task(self._flush())
+
+    def ack(self, key, payload):
+        #the current state as reported by the other side
+        self._acked[key]=payload
+
+    def _send(self, key, topic, payload):
+        self._last[key]=time.ticks_ms()
+        if self._keyed:
+            r=self.mqtt.publish(topic, payload, key)
+        else:
+            r=self.mqtt.publish(topic, payload)
+        if r is not False:
+            if r is not QUEUED:
+                self._acked[key]=payload
+            self.sent+=1
+
+    async def _flush(self):
+        #trailing edge: send the pending values once their interval is over
+        while self._pending:
+            now=time.ticks_ms()
+            wait=self.min_interval
+            for key in list(self._pending):
+                due=self.min_interval-time.ticks_diff(now, self._last[key])
+                if due<=0:
+                    topic,payload=self._pending.pop(key)
+                    self._send(key, topic, payload)
+                elif due<wait:
+                    wait=due
+            if self._pending:
+                await asyncio.sleep(wait/1000)
+        self._flushing=False
+
+    def stats(self):
+        return {'sent':self.sent, 'dropped':self.dropped, 'suppressed':self.suppressed, 'pending':len(self._pending)}
+
+
+class OfflineQueue:
+    # publishes directly while the client is connected and keeps the messages in a
+    # preallocated ring buffer while it is not; they are sent in order after reconnecting
+    # per key (default: the topic) only the latest message is kept (state), except for topics
+    # starting with one of the keep_all prefixes (events, e.g. rfid tags)
+    # publish returns True if sent, QUEUED if kept and False if rejected
+    # the buffer holds references to the payloads, the memory is limited by size*max_payload
+    def __init__(self, mqtt, size=32, max_payload=64, keep_all=(), path=None):
+        self.mqtt=mqtt
+        self.size=size
+        self.max_payload=max_payload
+        self.keep_all=tuple(keep_all)
+        self.path=path
+        self._topics=[None]*size
+        self._keys=[None]*size #None: the topic
+        self._payloads=[None]*size
+        self._head=0
+        self._count=0
+        self.connected=False
+        self.sent=0
+        self.queued=0
+        self.replaced=0
+        self.overflow=0 #oldest messages dropped because the buffer was full
+        self.rejected=0 #payload too long
+        self.connect_cbs=[] #called after (re)connecting, once the buffer is sent
+        mqtt.config(connected_cb=self._on_connect, disconnected_cb=self._on_disconnect)
+        if path is not None:
+            self.load()
+
+    def __len__(self):
+        return self._count
+
+    def _on_connect(self, *args):
+        self.connected=True
+        self.flush()
+        for cb in self.connect_cbs:
+            cb()
+
+    def on_connect(self, cb):
+        self.connect_cbs.append(cb)
+
+    def _on_disconnect(self, *args):
+        self.connected=False
+
+    def publish(self, topic, payload, key=None):
+        if self.connected and self._count==0:
+            if self.mqtt.publish(topic, payload) is not False:
+                self.sent+=1
+                return True
+            self.connected=False
+        return QUEUED if self.put(topic, payload, key) else False
+
+    def put(self, topic, payload, key=None):
+        if len(payload)>self.max_payload:
+            self.rejected+=1
+            return False
+        if key==topic:
+            key=None
+        size=self.size
+        if not self._is_event(topic):
+            i=self._head
+            for n in range(self._count):
+                if self._topics[i]==topic and self._keys[i]==key:
+                    self._payloads[i]=payload
+                    self.replaced+=1
+                    return True
+                i=(i+1)%size
+        if self._count==size:
+            self._head=(self._head+1)%size
+            self._count-=1
+            self.overflow+=1
+        i=(self._head+self._count)%size
+        self._topics[i]=topic
+        self._keys[i]=key
+        self._payloads[i]=payload
+        self._count+=1
+        self.queued+=1
+        return True
+
+    def _is_event(self, topic):
+        for prefix in self.keep_all: #str.startswith takes no tuple on micropython
+            if topic.startswith(prefix):
+                return True
+        return False
+
+    def flush(self):
+        #send the buffered messages in order, stops at the first failing publish
+        while self._count:
+            i=self._head
+            if self.mqtt.publish(self._topics[i], self._payloads[i]) is False:
+                self.connected=False
+                return False
+            self._topics[i]=None
+            self._keys[i]=None
+            self._payloads[i]=None
+            self._head=(i+1)%self.size
+            self._count-=1
+            self.sent+=1
+        return True
+
+    def save(self):
+        #write the buffered messages to flash, e.g. before deep sleep
+        if self.path is None:
+            return
+        with open(self.path, 'w') as f:
+            i=self._head
+            for n in range(self._count):
+                m=(self._topics[i], self._payloads[i])
+                f.write(json.dumps(m if self._keys[i] is None else m+(self._keys[i],)))
+                f.write('\n')
+                i=(i+1)%self.size
+        log.info('saved {} queued messages', self._count)
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    if line.strip():
+                        self.put(*json.loads(line))
+        except OSError:
+            return
+        open(self.path, 'w').close() #loaded messages are in RAM now
+        log.info('loaded {} queued messages', self._count)
+
+    def stats(self):
+        return {'sent':self.sent, 'queued':self.queued, 'pending':self._count, 'replaced':self.replaced, 
+            'overflow':self.overflow, 'rejected':self.rejected}
@@ -3,6 +3,11 @@ from machine import PWM, RTC, Pin, DEC
 import machine
 import time
 import uasyncio as asyncio
+import gc
+try:
+    import ujson as json
+except ImportError:
+    import json
 from math import copysign, sin, cos, pi
 from log import log
 
@@ -21,21 +26,52 @@ WHITE=rgb(255,255,255)
 BLACK=rgb(0,0,0)
 GRAY=rgb(128,128,128)
 LIGHTGRAY=rgb(211,211,211)
+COLORS={'RED':RED, 'GREEN':GREEN, 'BLUE':BLUE, 'YELLOW':YELLOW, 'ORANGE':ORANGE, 'WHITE':WHITE, 'BLACK':BLACK,
+    'GRAY':GRAY, 'LIGHTGRAY':LIGHTGRAY} #by name, for layouts
 
 
-class Widget:
-    def __init__(self, parent, bg=BLACK,fg=WHITE):
-        self.parent=parent
+class Style:
+    #colors and sizes, shared by all widgets that use the same values (see Style.get)
+    __slots__=('bg','fg','active_fg','bar_wd','ball_r','mar')
+    _shared={}
+
+    def __init__(self, bg=BLACK, fg=WHITE, active_fg=BLUE, bar_wd=4, ball_r=10, mar=15):
         self.bg=bg
         self.fg=fg
+        self.active_fg=active_fg
+        self.bar_wd=bar_wd
+        self.ball_r=ball_r
+        self.mar=mar
+
+    def get(self, bg=None, fg=None, active_fg=None, bar_wd=None, ball_r=None, mar=None):
+        #style with the given values replaced, returns self if nothing changes
+        key=(self.bg if bg is None else bg, self.fg if fg is None else fg, 
+            self.active_fg if active_fg is None else active_fg, self.bar_wd if bar_wd is None else bar_wd, 
+            self.ball_r if ball_r is None else ball_r, self.mar if mar is None else mar)
+        if key==(self.bg, self.fg, self.active_fg, self.bar_wd, self.ball_r, self.mar):
+            return self
+        style=Style._shared.get(key)
+        if style is None:
+            style=Style(*key)
+            Style._shared[key]=style
+        return style
+
+
+class Widget:
+    __slots__=('parent','is_visible','screen','win','style')
+    default_style=Style()
+
+    def __init__(self, parent, bg=None,fg=None):
+        self.parent=parent
+        self.style=self.default_style.get(bg=bg, fg=fg)
         self.is_visible=False
 
     def draw(self,screen, win):
-        log.debug('draw {} at {}'.format(self,win))
+        log.debug('draw {} at {}', self,win)
         
         self.is_visible=True# used if only one widget is updated
         if screen is not None:
-            self.screen=screen
+            self.screen=screen.device #the display, also when drawn through a Canvas
         else:
             screen=self.screen
         if win is not None:
@@ -43,12 +79,13 @@ class Widget:
         else:
             win=self.win
         screen.setwin(*win)
-        screen.set_bg(self.bg)
-        screen.set_fg(self.fg)
+        screen.set_bg(self.style.bg)
+        screen.set_fg(self.style.fg)
         #screen.clearwin()
     
     def grid(self, column=0, columnspan=1,row=None, rowspan=1):      
         self.parent.grid_geom.add(self, column, columnspan, row, rowspan)
+        self.root.layout_changed()
         
         
     def pack(self, *args, **kwargs):
@@ -67,94 +104,187 @@ class Widget:
     def deactivate(self):
         self.is_visible=False
 
+    def children(self):
+        return ()
+
+    def vars(self):
+        #the Vars this widget is bound to
+        return ()
+
+    def unbind(self):
+        #removes the widget from its Vars, so they no longer keep it alive
+        for v in self.vars():
+            if self in v.widgets:
+                v.widgets.remove(self)
+
+    def hit_areas(self, win, out):
+        #appends (area, widget, window) for the touchable areas of the visible widgets
+        out.append((win, self, win))
+
+    @property
+    def root(self):
+        return self.parent.root
+
+    def invalidate(self): #request a redraw with the next frame (see Tk.flush)
+        if self.is_visible:
+            self.root.invalidate(self)
+
+    #dragging: moves up to drag_deadband pixels are ignored, with drag_decimate only moves
+    #changing the value (see drag_changes) are passed to on_move
+    #defaults of all widgets, Slider takes them per instance
+    drag_deadband=1
+    drag_decimate=False
+
     def on_touch(self,pos, win, screen):        
         return self, win
+    def drag_changes(self, pos, win):
+        return True
     def on_move(self, pos, win, screen):
         pass
     def on_release(self, pos, win, screen):
-        log.info('unhandled release on {}, win ({}) at {}'.format(self,win, pos))
+        log.info('unhandled release on {}, win ({}) at {}', self,win, pos)
         pass
 
     #def __str__(self)
 
+def _bisect(a, x):
+    #index i of the last element with a[i]<=x (a is sorted ascending)
+    lo=0
+    hi=len(a)
+    while lo<hi:
+        mid=(lo+hi)//2
+        if x<a[mid]:
+            hi=mid
+        else:
+            lo=mid+1
+    return lo-1
+
+_EMPTY=0xFF #marks a free grid cell, so a grid takes at most 255 widgets
+
 class Grid:
     def __init__(self):
         self.ncols=0
+        self._nrows=1
         self.widgets=[]
-        self._grid=[[]]
+        self._spans=bytearray() #column, columnspan, row, rowspan for each widget
+        self._cells=bytearray() #widget index per cell, row major
         self.col_weights=[]
         self.row_weights=[1]
+        self._col_pos=None #cumulative weights, _col_pos[i] is the start of column i
+        self._row_pos=None
+        self._layout={} #window -> list of (widget, bbox) of all widgets
+
+    def _changed(self): #call whenever widgets or weights change
+        self._col_pos=None
+        self._row_pos=None
+        self._layout={}
+
+    def _positions(self):
+        if self._col_pos is None:
+            pos=[0]
+            for w in self.col_weights:
+                pos.append(pos[-1]+w)
+            self._col_pos=pos
+            pos=[0]
+            for w in self.row_weights:
+                pos.append(pos[-1]+w)
+            self._row_pos=pos
+        return self._col_pos, self._row_pos
 
     def add(self, widget, column=0, columnspan=1,row=None, rowspan=1 ):
         if row is None:
             row=self.nrows
         if not self.is_empty(column, columnspan,row, rowspan):
             raise GuiException('specified grid is not empty')
+        if len(self.widgets)>=_EMPTY:
+            raise GuiException('too many widgets in grid')
         self.extend_grid(column+ columnspan,row+rowspan)
         self._set(len(self.widgets), column, columnspan,row, rowspan)
-        self.widgets.append((widget, column, columnspan,row, rowspan))
+        self.widgets.append(widget)
+        self._spans.extend((column, columnspan,row, rowspan))
+        self._changed()
     
     def columnconfigure(self, index, weight):
         self.col_weights[index]=weight
+        self._changed()
 
     def rowconfigure(self, index, weight):
         self.row_weights[index]=weight
+        self._changed()
         
 
     @property
     def nrows(self):
-        return 0 if self.ncols==0 else len(self._grid) 
+        return 0 if self.ncols==0 else self._nrows
 
     def size(self):
         return(self.ncols, self.nrows)
 
-    #def grid_slaves(self, row=1, column=1):
-    #    idx=self._grid[row][column]          
-    #    if idx is None:
-    #        return None 
-    #    w=self.widgets[idx]
+    def span(self, idx): #column, columnspan, row, rowspan of the widget with index idx
+        o=4*idx
+        return tuple(self._spans[o:o+4])
+
+    def layout(self, window):
+        #all widgets with their bbox in window, cached until the grid changes
+        try:
+            return self._layout[window]
+        except KeyError:
+            pass
+        if len(self._layout)>4: #windows of a grid rarely change, do not let the cache grow
+            self._layout={}
+        res=[]
+        for i,w in enumerate(self.widgets):
+            c,cs,r,rs=self.span(i)
+            res.append((w,self.bbox(c,r,c+cs-1,r+rs-1,window)))
+        self._layout[window]=res
+        return res
 
     def slaves(self, column=None, row=None, window=None):
-        log.debug('get widget at [{},{}]'.format(row, column))
+        log.debug('get widget at [{},{}]', row, column)
         if row is None and column is None:
-            widgets=self.widgets
+            if window is not None:
+                yield from self.layout(window)
+                return
+            indices=range(len(self.widgets))
         elif row is None:
-            widgets=(self.widgets[idx] for idx in set([r[column] for r in self._grid ]) if idx is not None)
+            cells=self._cells
+            indices=set(cells[i] for i in range(column, len(cells), self.ncols))
         elif column is None:
-            widgets=(self.widgets[idx] for idx in set(self._grid[row]) if idx is not None)
+            o=row*self.ncols
+            indices=set(self._cells[o:o+self.ncols])
         else:
-            idx=self._grid[row][column]
-            if idx is None:
-                widgets=[]
-            else:
-                widgets=[self.widgets[idx]]
-        for w,c,cs,r,rs in widgets:
-            log.debug('selected {} at {},{}'.format(w,r,c))
+            indices=(self._cells[row*self.ncols+column],)
+        for idx in indices:
+            if idx==_EMPTY:
+                continue
+            w=self.widgets[idx]
+            c,cs,r,rs=self.span(idx)
+            log.debug('selected {} at {},{}', w,r,c)
             yield w,self.bbox(c,r,c+cs-1,r+rs-1,window)
 
     def is_empty(self, column, columnspan,row, rowspan):
+        cells=self._cells
+        end=min(column+columnspan, self.ncols)
         for i in range(row, min(row+rowspan, self.nrows) ):
-            for j in range(column, min(column+columnspan, self.ncols)):
-                if self._grid[i][j] is not None:
+            o=i*self.ncols
+            for idx in cells[o+column:o+end]:
+                if idx!=_EMPTY:
                     return False
         return True
 
     @staticmethod
-    def _get_idx( pos_rel, weights):
-        #pos_rel is between 0 and 1
-        total = sum(weights)
-        pos_rel*=total
-        os=0
-        for i,w in enumerate(weights):
-            if os+w>pos_rel:
-                return(i)
-            os+=w
+    def _get_idx( pos_rel, positions):
+        #pos_rel is between 0 and 1, positions are the cumulative weights
+        n=len(positions)-2
+        i=_bisect(positions, pos_rel*positions[-1])
+        return 0 if i<0 else n if i>n else i
 
     def location(self, pos,win):   
         x=(pos[0]-win[0])/(win[2]-win[0])
         y=(pos[1]-win[1])/(win[3]-win[1])
-        col=self._get_idx(x, self.col_weights)
-        row=self._get_idx(y, self.row_weights)
+        col_pos,row_pos=self._positions()
+        col=self._get_idx(x, col_pos)
+        row=self._get_idx(y, row_pos)
         return (col, row)
 
     def bbox(self, column=None, row=None, col2=None, row2=None, win=None):
@@ -171,12 +301,13 @@ class Grid:
         if row2 is None:
             row2=row
 
-        total_x=sum(self.col_weights)
-        total_y=sum(self.row_weights)
-        x1=sum(self.col_weights[:column])/total_x
-        x2=sum(self.col_weights[:col2+1])/total_x
-        y1=sum(self.row_weights[:row])/total_y
-        y2=sum(self.row_weights[:row2+1])/total_y
+        col_pos,row_pos=self._positions()
+        total_x=col_pos[-1]
+        total_y=row_pos[-1]
+        x1=col_pos[column]/total_x
+        x2=col_pos[col2+1]/total_x
+        y1=row_pos[row]/total_y
+        y2=row_pos[row2+1]/total_y
         if win is not None:
             x1*=(win[2]-win[0])
             x2*=(win[2]-win[0])
@@ -189,38 +320,62 @@ class Grid:
 
 
     def extend_grid(self, ncols, nrows):
-        log.debug('extend to {}x{}'.format(ncols, nrows))
+        log.debug('extend to {}x{}', ncols, nrows)
+        self._changed()
         if ncols>self.ncols:
             self.col_weights+=[1]*(ncols-self.ncols)
-            for r in self._grid:
-                r+=[None]*(ncols-self.ncols)
+            cells=bytearray([_EMPTY])*(ncols*self._nrows) #new row stride, copy the rows
+            for i in range(self._nrows):
+                cells[i*ncols:i*ncols+self.ncols]=self._cells[i*self.ncols:(i+1)*self.ncols]
+            self._cells=cells
             self.ncols=ncols            
 
         if nrows>self.nrows:
             self.row_weights+=[1]*(nrows-self.nrows)
-            self._grid+=[[None]*self.ncols]*(nrows-self.nrows)
+            self._cells.extend(bytearray([_EMPTY])*(self.ncols*(nrows-self._nrows)))
+            self._nrows=nrows
             
 
     def _set(self,n,  column, columnspan,row, rowspan):
         for i in range(row, row+rowspan):
-            for j in range(column, column+columnspan):
-                self._grid[i][j]=n
+            o=i*self.ncols+column
+            self._cells[o:o+columnspan]=bytearray([n])*columnspan
 
 
 
 
 
 class Frame(Widget):
-    def __init__(self,parent=None,  bg=BLACK,fg=WHITE):
+    __slots__=('grid_geom',)
+
+    def __init__(self,parent=None,  bg=None,fg=None):
         if parent is None and isinstance(self, display.TFT):
             raise GuiException('only the root can have no parent')
         super().__init__( parent,bg,fg)        
-        self.widgets=[]
         self.grid_geom=Grid()
             
     def clear_frame(self):
-        self.widgets=[]
         self.grid_geom=Grid()    
+        self.root.layout_changed()
+
+    def unload(self):
+        #removes all widgets, the Vars they showed stay alive and unbound
+        root=self.root
+        for w in root.walk(self):
+            w.unbind()
+            if w is root._focus_widget:
+                root._focus_widget=None
+                root._focus_window=None
+        for w in self.grid_geom.widgets: #not drawn by a pending redraw
+            w.deactivate()
+        self.clear_frame()
+
+    def children(self):
+        return self.grid_geom.widgets
+
+    def hit_areas(self, win, out):
+        for w,widget_win in self.grid_geom.layout(win):
+            w.hit_areas(widget_win, out)
 
     def draw(self,screen=None, win=None):
         super().draw(screen, win)
@@ -232,7 +387,7 @@ class Frame(Widget):
     def deactivate(self):
         self.is_visible=False
         for w in self.grid_geom.widgets:
-            w[0].deactivate()
+            w.deactivate()
     
     
     def on_touch(self,pos, win, screen):    
@@ -240,6 +395,8 @@ class Frame(Widget):
         return w.on_touch(pos, widget_win, screen)
 
 class Menue(Widget):
+    __slots__=('active','title_size','side','callback','pages')
+
     def __init__(self,parent, title_size, side=0,callback=None):
         super().__init__( parent)
         self.active=0
@@ -254,9 +411,28 @@ class Menue(Widget):
                 return p
         raise GuiException('page "{}" not found'.format(title))
 
-    def add_page(self, title,title_bg=BLUE,title_fg=WHITE,bg=BLACK,fg=WHITE,side=0):
-        self.pages.append(MenuePage(self,title,title_bg,title_fg,bg,fg,  side))
+    def add_page(self, title,title_bg=BLUE,title_fg=WHITE,bg=None,fg=None,side=0, builder=None):
+        #builder(page) creates the contents of the page when it is shown the first time
+        #(right away if root.lazy_pages is False), see MenuePage.unload
+        self.pages.append(MenuePage(self,title,title_bg,title_fg,bg,fg,  side, builder))
         return self.pages[-1]
+
+    def children(self):
+        return self.pages
+
+    def deactivate(self):
+        #hides the shown page with the Menue, down to the pages of its Menues
+        super().deactivate()
+        if self.pages:
+            self.pages[self.active].deactivate()
+
+    def hit_areas(self, win, out):
+        if self.side==0:#top
+            out.append(((win[0], win[1], win[2], win[1]+self.title_size), self, win))
+            self.pages[self.active].hit_areas((win[0], win[1]+self.title_size, win[2], win[3]), out)
+        elif self.side==1:#left
+            out.append(((win[0], win[1], win[0]+self.title_size, win[3]), self, win))
+            self.pages[self.active].hit_areas((win[0]+self.title_size, win[1], win[2], win[3]), out)
     
     def on_touch(self, pos, win, screen):        
         if self.side==0:#top
@@ -273,7 +449,7 @@ class Menue(Widget):
             return NotImplementedError
 
     def on_release(self, pos, win, screen):
-        log.debug('release in menue, prev page = '+self.pages[self.active].title)
+        log.debug('release in menue, prev page = {}', self.pages[self.active].title)
         selected= self.active
         
         if self.side==0:#top
@@ -289,10 +465,11 @@ class Menue(Widget):
 
     def select_page(self, new_page,screen,win):
         if new_page!= self.active:
-            log.info('selected '+self.pages[new_page].title)
+            log.info('selected {}', self.pages[new_page].title)
             self.pages[self.active].deactivate()
             self.active=new_page
-            self.draw(screen,win)
+            self.root.layout_changed()
+            self.root.redraw(self, win)
             if self.callback is not None:
                 self.callback()
 
@@ -333,15 +510,15 @@ class Menue(Widget):
                 screen.setwin(int(offset),win[1],int(offset+step),self.title_size+win[1])
             elif self.side==1:
                 screen.setwin(win[0], int(offset), win[0]+self.title_size, int(offset+step))
-            screen.text(screen.CENTER, screen.CENTER,p.title)
+            screen.cached_text(screen.CENTER, screen.CENTER,p.title)
             if i==self.active:#underline active
-                length=screen.textWidth(p.title)   
+                length,height=screen.text_extent(p.title)
                 if self.side==0:
                     line_x=int((step-length)/2 )
-                    line_y=int((self.title_size+screen.fontSize()[1])/2+2)
+                    line_y=int((self.title_size+height)/2+2)
                 elif self.side==1:
                     line_x=int((self.title_size-length)/2 )
-                    line_y=int((step+screen.fontSize()[1])/2+2)
+                    line_y=int((step+height)/2+2)
                 screen.line(line_x,line_y,line_x+length,line_y)       
             offset+=step     
         if self.side==0:    
@@ -350,33 +527,81 @@ class Menue(Widget):
             self.pages[self.active].draw(screen, (win[0]+self.title_size,win[1],win[2],win[3]))
 
 class MenuePage(Frame):
-    def __init__(self, parent, title, title_bg, title_fg,bg=BLUE,fg=WHITE, side=0):
+    __slots__=('title','title_bg','title_fg','builder','hidden_since','_built')
+
+    def __init__(self, parent, title, title_bg, title_fg,bg=None,fg=None, side=0, builder=None):
         super().__init__( parent, bg,fg)
         self.title=title
         self.title_bg=title_bg
         self.title_fg=title_fg
+        self.builder=builder
+        self.hidden_since=None #time.time() of the last deactivate, None while shown
+        self._built=False #builder ran since the last unload, a page may well build no widgets
+        if builder is not None and not self.root.lazy_pages:
+            self.build(True)
+
+    def build(self, strict=False):
+        #a failing builder raises with strict, otherwise the page shows the error instead of
+        #breaking the draw (the page is built again after unload)
+        if self.builder is not None and not self._built:
+            log.debug('build page {}', self.title)
+            self._built=True
+            try:
+                self.builder(self)
+            except Exception as e:
+                if strict:
+                    raise
+                log.exception('page {} not built', e, self.title)
+                Frame.unload(self)
+                Label(self, 'page not built: {!r}'.format(e)).grid()
+
+    def unload(self):
+        #frees the widgets of a page with builder, they are built again when it is shown
+        super().unload()
+        self._built=False
+        log.debug('unloaded page {}', self.title)
+
+    def draw(self, screen=None, win=None):
+        self.build()
+        self.hidden_since=None
+        super().draw(screen, win)
+
+    def deactivate(self):
+        super().deactivate()
+        self.hidden_since=time.time()
         
 class Label(Widget):    
+    __slots__=('halign','valign','text','decoration','static')
+
     def __init__(self,parent, text,decoration='{}',halign=1,valign=1):
         super().__init__(parent)
         self.halign=halign
         self.valign=valign
-        if isinstance(text,Var):
-            text.widgets.append(self)
-        else:
+        self.static=not isinstance(text,Var) #only static texts go to the text cache
+        if self.static:
             text=Var(text, self)
+        else:
+            text.widgets.append(self)
         self.text=text
         self.decoration=decoration
     
     def draw(self,screen=None, win=None):
         super().draw(screen, win)
-        self.screen.clearwin()
-        self.screen.text(self.screen.halign_const[self.halign],self.screen.valign_const[self.valign],self.decoration.format(self.text.val))
+        if screen is None:
+            screen=self.screen
+        screen.clearwin()
+        text=screen.cached_text if self.static else screen.text
+        text(screen.halign_const[self.halign],screen.valign_const[self.valign],self.decoration.format(self.text.val))
     
+    def vars(self):
+        return (self.text,)
+
     def __str__(self):
-        return('<{} object: {}>'.format(self.__qualname__, self.decoration.format(self.text.val)))
+        return('<{} object: {}>'.format(type(self).__name__, self.decoration.format(self.text.val)))
 
 class Button(Label):
+    __slots__=('command',)
+
     def __init__(self, parent, text, command,margin=10,decoration='{}',halign=1,valign=1):
         #todo: margins, minsize, maxsize
         super().__init__(parent, text,decoration, halign,valign)
@@ -392,8 +617,15 @@ class Button(Label):
         self.command()
     
 class Slider(Widget): 
-    def __init__(self, parent,  value,is_active=True, horizontal=True, min=0, max=100, command=None,select_command=None, bg=BLACK,fg=LIGHTGRAY, active_fg=BLUE, bar_wd=4,ball_r=10 , align=1, mar=15):
+    __slots__=('value','is_active','horizontal','min','max','command','select_command','align','_knob','_knob_active','_knob_win',
+        'drag_deadband','drag_decimate')
+    default_style=Style(fg=LIGHTGRAY)
+
+    def __init__(self, parent,  value,is_active=True, horizontal=True, min=0, max=100, command=None,select_command=None, bg=None,fg=None, active_fg=None, bar_wd=None,ball_r=None , align=1, mar=None,
+            drag_deadband=2, drag_decimate=True):
         super().__init__(parent)
+        self.drag_deadband=drag_deadband #see Widget.drag_deadband
+        self.drag_decimate=drag_decimate
         if isinstance(value,Var):
             value.widgets.append(self)
         else:
@@ -410,13 +642,11 @@ class Slider(Widget):
         self.max=max
         self.command=command
         self.select_command=select_command
-        self.bg=bg
-        self.fg=fg
-        self.active_fg=active_fg
-        self.bar_wd=bar_wd
-        self.ball_r=ball_r
-        self.mar=mar
+        self.style=self.default_style.get(bg, fg, active_fg, bar_wd, ball_r, mar)
         self.align=align
+        self._knob=None #knob position of the last draw, used for partial redraws
+        self._knob_active=False
+        self._knob_win=None
 
     def set_val(self,value, screen, win):
         self.value=value
@@ -444,65 +674,114 @@ class Slider(Widget):
         self.on_move(pos, win, screen)   
         return self, win
 
-    def on_move(self,pos, win, screen):        
+    def value_at(self, pos, win):
+        mar=self.style.mar
         if self.horizontal:
-            pos_rel=(pos[0]-win[0]-self.mar)/(win[2]-win[0]-2*self.mar)
+            pos_rel=(pos[0]-win[0]-mar)/(win[2]-win[0]-2*mar)
         else:
-            pos_rel=1-(pos[1]-win[1]-self.mar)/(win[3]-win[1]-2*self.mar)
+            pos_rel=1-(pos[1]-win[1]-mar)/(win[3]-win[1]-2*mar)
         if pos_rel<0:
             pos_rel=0
         elif pos_rel>1:
             pos_rel=1
-        self.value.val=int(self.min+pos_rel*(self.max-self.min))
-        log.debug ('new value {}'.format(self.value.val))
+        return int(self.min+pos_rel*(self.max-self.min))
+
+    def drag_changes(self, pos, win):
+        return self.value_at(pos, win)!=self.value.val
+
+    def vars(self):
+        return (self.value, self.is_active)
+
+    def on_move(self,pos, win, screen):        
+        self.value.val=self.value_at(pos, win)
+        log.debug('new value {}', self.value.val)
     
     def on_release(self, pos, win,screen):
         if self.command is not None:
             self.command(self.value)
 
+    def _geometry(self, win):
+        #bar length, knob position along the bar and knob center across the bar (window coordinates)
+        mar=self.style.mar
+        val_rel=(self.value.val-self.min)/(self.max-self.min)
+        if self.horizontal:#left to right
+            len=win[2]-win[0]-2*mar
+            return len, int(mar+val_rel*len), int((win[3]-win[1])/2)
+        else: #bottom to top
+            len=win[3]-win[1]-2*mar
+            return len, int(mar+(1-val_rel)*len), int((win[2]-win[0])/2)
+
     def draw(self, screen=None,win=None):
+        #drawing with explicit screen/window (by the parent) repaints everything,
+        #a redraw of a value change only moves the knob if window and color did not change 
+        full=screen is not None or win is not None or self._knob is None
         super().draw(screen, win)
         if screen is None:
             screen=self.screen
-        if win is None:
-            win=self.win
-        screen.clearwin()
-        val_rel=(self.value.val-self.min)/(self.max-self.min)
-        if self.value.val>self.min and self.is_active.val:
-                fg=bg=self.active_fg
+        win=self.win
+        st=self.style
+        mar=st.mar
+        bar_wd=st.bar_wd
+        r=st.ball_r
+        active=self.value.val>self.min and self.is_active.val
+        if active:
+                fg=bg=st.active_fg
         else:
-            fg=self.fg
-            bg=self.bg
-        if self.horizontal:#left to right
-            len=win[2]-win[0]-2*self.mar
-            y=int((win[3]-win[1]-self.bar_wd)/2)
-            screen.rect(self.mar, y, int(val_rel*len), self.bar_wd, fg,fg)
-            screen.rect(int(self.mar+val_rel*len), y, int((1-val_rel)*len), self.bar_wd, self.fg,self.fg)            
-            screen.circle(int(self.mar+val_rel*len),int((win[3]-win[1])/2),self.ball_r, fg, bg)
-        else: #bottom to top
-            len=win[3]-win[1]-2*self.mar
-            x=int((win[2]-win[0]-self.bar_wd)/2)
-            screen.rect(x,self.mar,  self.bar_wd, int((1-val_rel)*len),self.fg,self.fg)
-            screen.rect(x,int(self.mar+(1-val_rel)*len), self.bar_wd,int(val_rel*len),  self.fg,self.fg)
-            
-            screen.circle(int((win[2]-win[0])/2),int(self.mar+(1-val_rel)*len),self.ball_r, fg, bg)
+            fg=st.fg
+            bg=st.bg
+        len,pos,center=self._geometry(win)
+        if full or active!=self._knob_active or win!=self._knob_win:
+            screen.clearwin()
+            if self.horizontal:#left to right
+                y=int((win[3]-win[1]-bar_wd)/2)
+                screen.rect(mar, y, pos-mar, bar_wd, fg,fg)
+                screen.rect(pos, y, mar+len-pos, bar_wd, st.fg,st.fg)            
+                screen.circle(pos,center,r, fg, bg)
+            else: #bottom to top
+                x=int((win[2]-win[0]-bar_wd)/2)
+                screen.rect(x,mar,  bar_wd, pos-mar,st.fg,st.fg)
+                screen.rect(x,pos, bar_wd,mar+len-pos,  st.fg,st.fg)
+                screen.circle(center,pos,r, fg, bg)
+        elif pos!=self._knob:
+            old=self._knob
+            #bar segment covered by the old knob and the way to the new one
+            a=max(mar, min(old,pos)-r)
+            b=min(mar+len, max(old,pos)+r+1)
+            if self.horizontal:
+                y=int((win[3]-win[1]-bar_wd)/2)
+                screen.rect(old-r, center-r, 2*r+1, 2*r+1, st.bg, st.bg)
+                if pos>a:
+                    screen.rect(a, y, min(pos,b)-a, bar_wd, fg,fg)
+                if b>pos:
+                    screen.rect(max(pos,a), y, b-max(pos,a), bar_wd, st.fg,st.fg)
+                screen.circle(pos,center,r, fg, bg)
+            else:
+                x=int((win[2]-win[0]-bar_wd)/2)
+                screen.rect(center-r, old-r, 2*r+1, 2*r+1, st.bg, st.bg)
+                screen.rect(x, a, bar_wd, b-a, st.fg,st.fg)
+                screen.circle(center,pos,r, fg, bg)
+        self._knob=pos
+        self._knob_active=active
+        self._knob_win=win
 
         
 
 
 class CheckBox(Widget):
-    pass
+    __slots__=()
 
 class RadioButton(Widget):
-    pass
+    __slots__=()
 
 class Switch(CheckBox):
-    pass
+    __slots__=()
 
 class Chart(Widget):
-    pass
+    __slots__=()
 
 class DynamicWidget(Widget):
+    __slots__=('is_active',)
+
     def __init__(self, parent):
         super().__init__(parent)
         self.is_active=False
@@ -522,16 +801,23 @@ class DynamicWidget(Widget):
     def update(self, screen, win):
         #do something
         #print('dynamic widget update is not implemented')
-        self.draw(screen, win)
+        screen.redraw(self, win)
 
 class Clock(DynamicWidget):
+    __slots__=('halign','valign','analog')
+    ntp_synced=False #the rtc is synced once, when the first clock is shown
 
     def __init__(self,parent,  halign=1, valign=1, analog=True):
         super().__init__(parent)
         self.halign=halign
         self.valign=valign
         self.analog=analog
-        RTC().ntp_sync(server="hr.pool.ntp.org", tz="CET-1CEST")
+
+    def activate(self, screen, win, interval=1):
+        if not Clock.ntp_synced:
+            RTC().ntp_sync(server="hr.pool.ntp.org", tz="CET-1CEST")
+            Clock.ntp_synced=True
+        super().activate(screen, win, interval)
     
       
     def draw(self,screen=None, win=None):
@@ -542,7 +828,7 @@ class Clock(DynamicWidget):
             win=self.win
 
         if not self.is_active:
-            self.activate(screen, win)
+            self.activate(self.screen, win)
         screen.clearwin()
         now=time.localtime()
         if self.analog:
@@ -558,34 +844,28 @@ class Clock(DynamicWidget):
 
 
 class FotoFrame(Widget):
-    pass
+    __slots__=()
 
 
 class Var:
+    __slots__=('_val','widgets','t')
+
     def __init__(self, val, widget=None, t=None):
-        self.__val=val
+        self._val=val
         self.widgets=[]
         self.t=t
         if isinstance(widget, Widget):
             self.widgets.append(widget)
         
     def __get__(self, instance, owner):
-        return self.__val
+        return self._val
 
     def __set__(self, instance, val):
-        if self.t is not None:
-            if self.t==bool:
-                val=str(val).lower() in ['true' ,'yes', '1', 'on', 'high']
-            val=self.t(val)
-        if self.__val != val:
-            self.__val=val        
-            for w in self.widgets:
-                if w.is_visible:
-                    w.draw()
+        self.val=val
 
     @property
     def val(self):
-        return self.__val
+        return self._val
     
     @val.setter
     def val(self, val):
@@ -593,12 +873,519 @@ class Var:
             if self.t==bool:
                 val=str(val).lower() in ['true' ,'yes', '1', 'on', 'high']
             val=self.t(val)
-        if self.__val != val:
-            self.__val=val        
+        if self._val != val:
+            self._val=val        
             for w in self.widgets:
-                if w.is_visible:
-                    w.draw()
-
+                w.invalidate() #drawn with the next frame, not right away
+
+
+_TYPES={'int':int, 'float':float, 'bool':bool, 'str':str}
+
+class Layout:
+    # builds the widget tree from a declarative description (parsed json), e.g.
+    # {"vars": {"bgled": [100, "int"], "temp": [0, "float", "web/temp"]},
+    #  "ui": {"w": "Menue", "title_size": 60, "side": 1, "pages": [
+    #   {"title": "Settings", "title_bg": "YELLOW", "children": [
+    #    {"w": "Label", "text": "$temp", "decoration": "{} C", "grid": {"columnspan": 2}},
+    #    {"w": "Slider", "value": "$bgled", "min": 1, "command": "backlight", "grid": {"row": 1}}]}]}}
+    # vars are [value, type(, topic bound with router)], allocated before the widgets, and kept
+    # (with their values) when a new layout uses the same name
+    # widget arguments: "$name" is a Var, color names (for bg and fg) are the constants of this
+    # module, commands are [name, args...] (or name) of a factory in commands that returns the callable
+    # "grid" are the arguments of grid(), "pages" the pages of a Menue (built when shown, see
+    # Menue.add_page) and "children" the widgets in a Frame or page
+    types={'Frame':Frame, 'Menue':Menue, 'Label':Label, 'Button':Button, 'Slider':Slider, 'Clock':Clock}
+    _commands=('command', 'select_command', 'callback')
+
+    def __init__(self, commands=None, router=None):
+        self.commands=commands or {}
+        self.router=router
+        self.vars={} #name -> Var, the application can add its own before apply
+        self._bound=set()
+
+    def apply(self, root, spec, draw=True, check_pages=True):
+        #replaces the widgets of root with spec (json text or parsed), returns the parsed spec
+        #an invalid spec raises GuiException (ValueError for bad json) and leaves root unchanged:
+        #the new tree is built off the root, with check_pages each page is built once (one at a
+        #time, unloaded again with lazy pages; not needed for a spec applied before, it would undo
+        #lazy_pages), and with draw it is drawn before the old tree is dropped (without, e.g. while
+        #nothing is shown yet, the caller draws)
+        if isinstance(spec, (str, bytes)):
+            spec=json.loads(spec)
+        vars=spec.get('vars', {})
+        self.check(spec.get('ui', ()), vars)
+        for name,v in vars.items():
+            if name not in self.vars:
+                self.vars[name]=Var(v[0], t=_TYPES[v[1]] if len(v)>1 else None)
+            if len(v)>2 and self.router is not None and (v[2], name) not in self._bound:
+                self._bound.add((v[2], name))
+                self.router.bind(v[2], self.vars[name])
+        new=Frame(root)
+        try:
+            self.build(new, spec['ui'])
+            if check_pages:
+                self._build_pages(new, root.lazy_pages)
+        except Exception as e:
+            new.unload()
+            raise GuiException('layout not built: {!r}'.format(e))
+        old=Frame(root)
+        _move_widgets(root, old)
+        _move_widgets(new, root)
+        if draw:
+            try:
+                root.draw()
+            except Exception as e:
+                root.unload()
+                _move_widgets(old, root)
+                root.draw()
+                raise GuiException('layout not drawn: {!r}'.format(e))
+        old.unload()
+        return spec
+
+    def _build_pages(self, widget, lazy):
+        #runs the builders of the pages below widget, so they raise here and not when shown
+        for w in widget.children():
+            if isinstance(w, MenuePage) and not w._built:
+                w.build(True)
+                self._build_pages(w, lazy)
+                if lazy:
+                    w.unload()
+            else:
+                self._build_pages(w, lazy)
+
+    def check(self, spec, vars, page=False):
+        #raises GuiException for unknown widgets, Vars, colors and commands, without building
+        if isinstance(spec, list):
+            for s in spec:
+                self.check(s, vars, page)
+            return
+        if not page and spec.get('w') not in self.types:
+            raise GuiException('unknown widget "{}"'.format(spec.get('w')))
+        for k,v in spec.items():
+            if k in ('pages', 'children'):
+                self.check(v, vars, k=='pages')
+            elif isinstance(v, str) and v.startswith('$') and v[1:] not in vars and v[1:] not in self.vars:
+                raise GuiException('unknown var "{}"'.format(v))
+            elif k in self._commands and (v if isinstance(v, str) else v[0]) not in self.commands:
+                raise GuiException('unknown command "{}"'.format(v))
+            elif k[-2:] in ('bg', 'fg') and isinstance(v, str) and v not in COLORS:
+                raise GuiException('unknown color "{}"'.format(v))
+
+    def _arg(self, k, v):
+        if isinstance(v, str):
+            if v.startswith('$'):
+                return self.vars[v[1:]]
+            if k[-2:] in ('bg', 'fg'):
+                return COLORS[v]
+        if k in self._commands:
+            if isinstance(v, str):
+                return self.commands[v]()
+            return self.commands[v[0]](*v[1:])
+        return v
+
+    def build(self, parent, spec):
+        #creates the widgets of spec in parent in one pass, pages are only set up
+        if isinstance(spec, list):
+            for s in spec:
+                self.build(parent, s)
+            return
+        kwargs={}
+        for k,v in spec.items():
+            if k not in ('w', 'grid', 'pages', 'children'):
+                kwargs[k]=self._arg(k, v)
+        w=self.types[spec['w']](parent, **kwargs)
+        w.grid(**spec.get('grid', {}))
+        for page in spec.get('pages', ()):
+            kwargs={}
+            for k,v in page.items():
+                if k!='children':
+                    kwargs[k]=self._arg(k, v)
+            w.add_page(builder=lambda p,children=page.get('children', ()): self.build(p, children), **kwargs)
+        for c in spec.get('children', ()):
+            self.build(w, c)
+        return w
+
+
+def _move_widgets(src, dst):
+    #moves the widgets of frame src to frame dst, whose own widgets are dropped
+    dst.grid_geom=src.grid_geom
+    src.grid_geom=Grid()
+    for w in dst.grid_geom.widgets:
+        w.parent=dst
+    dst.root.layout_changed()
+
+
+def _clone(obj):
+    #shallow copy of a widget or Var, has the same attribute layout as the original
+    cls=type(obj)
+    new=cls.__new__(cls)
+    try:
+        items=list(obj.__dict__.items())
+    except AttributeError: #__slots__ on the host
+        items=[(n,getattr(obj,n)) for c in cls.__mro__ for n in c.__dict__.get('__slots__',()) if hasattr(obj,n)]
+    for n,v in items:
+        setattr(new,n,v)
+    return new
+
+def _measure(fn):
+    #bytes allocated by fn(), the result is kept alive while measuring
+    try:
+        import tracemalloc
+    except ImportError:
+        tracemalloc=None
+    if tracemalloc is not None:
+        started=not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        before=tracemalloc.get_traced_memory()[0]
+        keep=fn()
+        size=tracemalloc.get_traced_memory()[0]-before
+        if started:
+            tracemalloc.stop()
+    else:
+        gc.collect()
+        before=gc.mem_free()
+        keep=fn()
+        size=before-gc.mem_free()
+    del keep
+    return size
+
+
+class TextCache:
+    #LRU of rendered texts, keyed by (text, font, fg, bg)
+    #entries are [width, height, pixels or None, last use], the pixels are the text box as read back
+    #from the display and only kept within budget bytes, which holds the static texts of a layout
+    #(labels without a Var and titles, about 20 KB for layout.json), with fewer the LRU misses every frame
+    def __init__(self, budget=24576):
+        self.budget=budget
+        self.used=0
+        self.entries={}
+        self.hits=0
+        self.misses=0
+        self.evictions=0
+        self._tick=0
+
+    def get(self, key):
+        e=self.entries.get(key)
+        if e is None:
+            self.misses+=1
+        else:
+            self.hits+=1
+            self._tick+=1
+            e[3]=self._tick
+        return e
+
+    def add(self, key, w, h, buf=None):
+        if buf is not None and len(buf)>self.budget//4: #one text must not flush the cache
+            buf=None
+        size=len(buf) if buf is not None else 0
+        old=self.entries.pop(key, None)
+        if old is not None and old[2] is not None:
+            self.used-=len(old[2])
+        while self.used+size>self.budget:
+            self._evict()
+        self._tick+=1
+        e=[w, h, buf, self._tick]
+        self.entries[key]=e
+        self.used+=size
+        if len(self.entries)>256: #extents are cheap but not free
+            self._evict(False)
+        return e
+
+    def _evict(self, bitmaps=True):
+        #drops the pixels of the least recently used entry holding some, the extents are kept,
+        #or the least recently used entry
+        lru=None
+        for e in self.entries.values():
+            if (e[2] is not None or not bitmaps) and (lru is None or e[3]<lru[3]):
+                lru=e
+        if bitmaps:
+            self.used-=len(lru[2])
+            lru[2]=None
+        else:
+            for k,e in self.entries.items():
+                if e is lru:
+                    break
+            del self.entries[k]
+            if e[2] is not None:
+                self.used-=len(e[2])
+        self.evictions+=1
+
+    def clear(self):
+        self.entries={}
+        self.used=0
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses, evictions=self.evictions, entries=len(self.entries), bytes=self.used)
+
+
+def _text_pos(x, y, w, h, win):
+    #absolute position of a w x h text box placed at x,y (or CENTER, RIGHT, BOTTOM) in win
+    x1,y1,x2,y2=win
+    if x==display.TFT.CENTER:
+        x=(x2-x1+1-w)//2
+    elif x==display.TFT.RIGHT:
+        x=x2-x1+1-w
+    if y==display.TFT.CENTER:
+        y=(y2-y1+1-h)//2
+    elif y==display.TFT.BOTTOM:
+        y=y2-y1+1-h
+    return x+x1, y+y1
+
+
+class Canvas:
+    #off-screen compositing (see Tk.set_compositing): a widget draws into a display list, which is
+    #rasterized strip by strip into one buffer of strip_height screen rows (3 bytes per pixel like the
+    #display RAM) and pushed with one window write per strip, so the screen never shows partial paints
+    #texts come from the text cache of the device, new texts are drawn on the device after the push
+    #(and are in the cache from then on)
+    CENTER=display.TFT.CENTER
+    RIGHT=display.TFT.RIGHT
+    BOTTOM=display.TFT.BOTTOM
+    halign_const=[0,CENTER,RIGHT]
+    valign_const=[0,CENTER,BOTTOM]
+
+    def __init__(self, device, strip_height=16):
+        self.device=device
+        self.strip_height=strip_height
+        self._buf=bytearray(max(device.screensize())*strip_height*3)
+        self._ops=[] #(x1,y1,x2,y2,color) fills and (x1,y1,x2,y2,pixels) blits, absolute and clipped
+        self._texts=[]
+        self._rows={}
+        self._win=(0,0,0,0)
+        self._fg=0xFFFFFF
+        self._bg=0
+        self.pushed=0 #bytes written to the display
+        self.strips=0
+
+    def screensize(self):
+        return self.device.screensize()
+
+    def setwin(self, x1, y1, x2, y2):
+        w,h=self.device.screensize()
+        self._win=(max(0,int(x1)), max(0,int(y1)), min(w-1,int(x2)), min(h-1,int(y2)))
+
+    def resetwin(self):
+        self.setwin(0, 0, *self.device.screensize())
+
+    def winsize(self):
+        x1,y1,x2,y2=self._win
+        return (x2-x1+1, y2-y1+1)
+
+    def set_fg(self, color):
+        self._fg=color
+
+    def set_bg(self, color):
+        self._bg=color
+
+    def get_fg(self):
+        return self._fg
+
+    def get_bg(self):
+        return self._bg
+
+    def font(self, *args, **kwargs):
+        self.device.font(*args, **kwargs)
+
+    def fontSize(self):
+        return self.device.fontSize()
+
+    def textWidth(self, text):
+        return self.device.textWidth(text)
+
+    def text_extent(self, text):
+        return self.device.text_extent(text, self._fg, self._bg)
+
+    def _fill(self, x1, y1, x2, y2, color):
+        wx1,wy1,wx2,wy2=self._win
+        x1=max(x1,wx1)
+        y1=max(y1,wy1)
+        x2=min(x2,wx2)
+        y2=min(y2,wy2)
+        if x2>=x1 and y2>=y1:
+            self._ops.append((x1, y1, x2, y2, color))
+
+    def clearwin(self, color=None):
+        self._fill(*self._win, self._bg if color is None else color)
+
+    def pixel(self, x, y, color=None):
+        self._fill(self._win[0]+x, self._win[1]+y, self._win[0]+x, self._win[1]+y, self._fg if color is None else color)
+
+    def rect(self, x, y, w, h, color=None, fillcolor=None):
+        if w<=0 or h<=0:
+            return
+        x+=self._win[0]
+        y+=self._win[1]
+        color=self._fg if color is None else color
+        if fillcolor is not None:
+            self._fill(x, y, x+w-1, y+h-1, fillcolor)
+        self._fill(x, y, x+w-1, y, color)
+        self._fill(x, y+h-1, x+w-1, y+h-1, color)
+        self._fill(x, y, x, y+h-1, color)
+        self._fill(x+w-1, y, x+w-1, y+h-1, color)
+
+    def circle(self, x, y, r, color=None, fillcolor=None):
+        x+=self._win[0]
+        y+=self._win[1]
+        color=self._fg if color is None else color
+        for dy in range(-r, r+1):
+            dx=int((r*r-dy*dy)**.5)
+            if fillcolor is not None:
+                self._fill(x-dx, y+dy, x+dx, y+dy, fillcolor)
+            self._fill(x-dx, y+dy, x-dx, y+dy, color)
+            self._fill(x+dx, y+dy, x+dx, y+dy, color)
+
+    def line(self, x, y, x1, y1, color=None):
+        ox,oy=self._win[:2]
+        color=self._fg if color is None else color
+        dx=abs(x1-x)
+        dy=-abs(y1-y)
+        sx=1 if x<x1 else -1
+        sy=1 if y<y1 else -1
+        err=dx+dy
+        while True:
+            self._fill(ox+x, oy+y, ox+x, oy+y, color)
+            if x==x1 and y==y1:
+                break
+            e2=2*err
+            if e2>=dy:
+                err+=dy
+                x+=sx
+            if e2<=dx:
+                err+=dx
+                y+=sy
+
+    def text(self, x, y, text, *args, **kwargs):
+        self._texts.append((self._win, self._fg, self._bg, x, y, text, False))
+
+    def cached_text(self, x, y, text):
+        dev=self.device
+        e=dev.text_cache.get((text, dev._font, self._fg, self._bg))
+        if e is not None and e[2] is not None:
+            w,h=e[0],e[1]
+            x,y=_text_pos(x, y, w, h, self._win)
+            wx1,wy1,wx2,wy2=self._win
+            if x>=wx1 and y>=wy1 and x+w-1<=wx2 and y+h-1<=wy2:
+                self._ops.append((x, y, x+w-1, y+h-1, e[2]))
+                return
+        self._texts.append((self._win, self._fg, self._bg, x, y, text, True))
+
+    def render(self, widget, win):
+        #draws widget in win through the strip buffer
+        dev=self.device
+        sw,sh=dev.screensize()
+        x1=max(0,int(win[0]))
+        y1=max(0,int(win[1]))
+        x2=min(sw-1,int(win[2]))
+        y2=min(sh-1,int(win[3]))
+        if x2<x1 or y2<y1:
+            return
+        self._ops=[(x1, y1, x2, y2, widget.style.bg)] #cells without widgets
+        self._texts=[]
+        widget.draw(self, win)
+        ops=self._ops
+        texts=self._texts
+        self._ops=[]
+        self._texts=[]
+        w=x2-x1+1
+        rows=max(1, min(self.strip_height, len(self._buf)//(3*w)))
+        buf=memoryview(self._buf)
+        for sy in range(y1, y2+1, rows):
+            ey=min(y2, sy+rows-1)
+            self._raster(ops, x1, sy, x2, ey)
+            n=3*w*(ey-sy+1)
+            dev.write_ram(x1, sy, x2, ey, buf[:n])
+            self.pushed+=n
+            self.strips+=1
+        self._rows={}
+        for t in texts:
+            dev.setwin(*t[0])
+            dev.set_fg(t[1])
+            dev.set_bg(t[2])
+            if t[6]:
+                dev.cached_text(t[3], t[4], t[5])
+            else:
+                dev.text(t[3], t[4], t[5])
+
+    def _raster(self, ops, x1, sy, x2, ey):
+        buf=self._buf
+        stride=3*(x2-x1+1)
+        rows=self._rows
+        for ox1,oy1,ox2,oy2,c in ops:
+            if oy2<sy or oy1>ey or ox2<x1 or ox1>x2:
+                continue
+            a=max(ox1,x1)
+            b=min(ox2,x2)
+            if isinstance(c, int):
+                row=rows.get(c)
+                if row is None:
+                    row=memoryview(bytes(((c>>16)&0xFF, (c>>8)&0xFF, c&0xFF))*(x2-x1+1))
+                    rows[c]=row
+                src=row[:3*(b-a+1)]
+                for y in range(max(oy1,sy), min(oy2,ey)+1):
+                    o=(y-sy)*stride+(a-x1)*3
+                    buf[o:o+len(src)]=src
+            else: #blit of pixels ox2-ox1+1 wide
+                bw=3*(ox2-ox1+1)
+                n=3*(b-a+1)
+                for y in range(max(oy1,sy), min(oy2,ey)+1):
+                    o=(y-sy)*stride+(a-x1)*3
+                    s=(y-oy1)*bw+(a-ox1)*3
+                    buf[o:o+n]=c[s:s+n]
+
+
+def _affine_mul(m, n):
+    #affine map m after n, both as (a,b,c,d,e,f)
+    return (m[0]*n[0]+m[1]*n[3], m[0]*n[1]+m[1]*n[4], m[0]*n[2]+m[1]*n[5]+m[2],
+        m[3]*n[0]+m[4]*n[3], m[3]*n[1]+m[4]*n[4], m[3]*n[2]+m[4]*n[5]+m[5])
+
+def _det3(m):
+    return (m[0][0]*(m[1][1]*m[2][2]-m[1][2]*m[2][1])-m[0][1]*(m[1][0]*m[2][2]-m[1][2]*m[2][0])
+        +m[0][2]*(m[1][0]*m[2][1]-m[1][1]*m[2][0]))
+
+def _fit_affine(raw, screen):
+    #least squares affine map from raw to screen points (at least 3 points)
+    sxx=sxy=syy=sx=sy=0
+    for x,y in raw:
+        sxx+=x*x
+        sxy+=x*y
+        syy+=y*y
+        sx+=x
+        sy+=y
+    m=((sxx,sxy,sx),(sxy,syy,sy),(sx,sy,len(raw)))
+    det=_det3(m)
+    if det==0:
+        raise GuiException('touch calibration points are collinear')
+    res=()
+    for k in range(2):
+        v=[0,0,0]
+        for (x,y),p in zip(raw, screen):
+            v[0]+=x*p[k]
+            v[1]+=y*p[k]
+            v[2]+=p[k]
+        for i in range(3): #cramer's rule
+            mi=tuple(tuple(v[r] if c==i else m[r][c] for c in range(3)) for r in range(3))
+            res+=(_det3(mi)/det,)
+    return res
+
+
+class _Batch:
+    #context of Tk.batch
+    __slots__=('root',)
+
+    def __init__(self, root):
+        self.root=root
+
+    def __enter__(self):
+        self.root._batch+=1
+        return self.root
+
+    def __exit__(self, *exc):
+        root=self.root
+        root._batch-=1
+        if not root._batch and not root.initiated: #no redraw loop that picks them up
+            root.flush()
+        return False
 
 
 class Tk(display.TFT, Frame): 
@@ -608,14 +1395,53 @@ class Tk(display.TFT, Frame):
     
     def __init__(self):
         super().__init__(self)
-        self.bg=BLACK
-        self.fg=WHITE
+        self.style=Widget.default_style
+        self._hit_ys=None #hit test index, see _build_hit_index
+        self._hit_bands=None
+        self.text_cache=TextCache() #see cached_text
+        self._font=display.TFT.FONT_Default
+        self._cur_win=(0,0,0,0)
+        self.canvas=None #off-screen compositing, see set_compositing
         self.clear_frame()
         self.standby_time=60
         self.shutdown_time=100
         self.wakeup_pin=None
+        self.shutdown_cbs=[] #called before going to deep sleep
+        self.touch_active_freq=80 #touch poll rate (Hz) while touched and for touch_linger s after
+        self.touch_idle_freq=5 #the rate decays to this when nobody touches the screen
+        self.touch_linger=2
+        self.touch_penirq=None
+        self._pen_irq=None #ticks_ms of the last PENIRQ interrupt
+        self._touch_session=False #a task polls the touch controller after a PENIRQ
+        self._start_touch_cb=self._start_touch_session #bound once, the irq handler does not allocate
+        self._touch_interval=1000//self.touch_active_freq #current poll interval (ms)
+        self.touch_polls=0 #number of touch controller reads
+        self.touch_latency=0 #ms from PENIRQ (or the previous poll) to handling the touch
+        self.touch_latency_max=0
+        self._touch_stats=(0,0)
+        self._last_poll=0
+        self.touch_samples=3 #readings per poll, the median is used
+        self.touch_spread=8 #max spread (pixels) of the readings of one poll
+        self._touch_xs=[]
+        self._touch_ys=[]
+        self.touch_rejected=0
+        self.touch_moves=0 #moves passed to the widgets
+        self.touch_moves_dropped=0 #moves filtered out by dead band or decimation
         self.touch_calibration=(500,3500,500,3500)
+        self.touch_matrix=None #affine calibration, see calibrate_touch
+        self.touch_matrix_rot=None
+        self._touch_fixed=None
         self.initiated=0
+        self.parent=None
+        self.is_visible=False
+        self.max_fps=25 #upper limit for redraws of invalidated widgets
+        self._dirty={} #widget -> window, collected until the next frame
+        self.frames=0 #number of flushed frames
+        self.draws=0 #number of widget draws done by flush
+        self.draws_skipped=0 #draws saved by coalescing invalidations
+        self._batch=0 #depth of nested batch() contexts, frames are held back while >0
+        self.lazy_pages=True #pages with builder are built when shown first (see Menue.add_page)
+        self.page_unload_time=None #s after which hidden pages with builder are freed, None keeps them
         #self.movable=False
     
    
@@ -638,9 +1464,14 @@ class Tk(display.TFT, Frame):
         if 'hid' in kwargs:
             self.init_hid(kwargs['hid'])
             del kwargs['hid']
+        if 'penirq_pin' in kwargs: #touch controller interrupt, no polling while idle
+            self.set_penirq_pin(kwargs['penirq_pin'])
+            del kwargs['penirq_pin']
         kwargs.setdefault('rot',super().LANDSCAPE)
         super().init( *args, **kwargs)
         self.rot=kwargs['rot']
+        self._touch_fixed=None
+        self.load_touch_calibration()
         self.timestamp=time.time()
         self.standby=False
         self.touch_start=None #start position of touch event
@@ -650,6 +1481,186 @@ class Tk(display.TFT, Frame):
         self.initiated=1
         loop = asyncio.get_event_loop()
         loop.create_task(self.handle_touch())
+        loop.create_task(self.handle_redraw())
+        loop.create_task(self.handle_pages())
+
+    @property
+    def root(self):
+        return self
+
+    def unload_pages(self, widget=None, now=None):
+        #frees the pages with builder hidden for more than page_unload_time seconds
+        if widget is None:
+            widget=self
+            now=time.time()
+        n=0
+        for w in widget.children():
+            if isinstance(w, MenuePage) and w.builder is not None and w.hidden_since is not None \
+                    and now-w.hidden_since>self.page_unload_time and w._built:
+                w.unload()
+                n+=1
+            else:
+                n+=self.unload_pages(w, now)
+        return n
+
+    async def handle_pages(self):
+        while self.initiated:
+            if self.page_unload_time is not None:
+                if self.unload_pages():
+                    gc.collect()
+            await asyncio.sleep(10)
+
+    def layout_changed(self):
+        #visible widgets or their windows changed, rebuild the hit test index with the next touch
+        self._hit_ys=None
+
+    def _build_hit_index(self):
+        #the touchable areas cut into horizontal bands at every top and bottom edge,
+        #each band holds its areas sorted by the left edge
+        areas=[]
+        Frame.hit_areas(self, (0,0,self.width, self.height), areas)
+        ys=sorted(set([a[0][1] for a in areas]+[a[0][3] for a in areas]))
+        bands=[]
+        for i in range(len(ys)-1):
+            entries=sorted([a for a in areas if a[0][1]<=ys[i]<a[0][3]], key=lambda a:a[0][0])
+            bands.append(([a[0][0] for a in entries], entries))
+        self._hit_bands=bands
+        self._hit_ys=ys
+
+    def hit(self, pos):
+        #(area, widget, window) of the widget at pos, or None
+        if self._hit_ys is None:
+            self._build_hit_index()
+        ys=self._hit_ys
+        i=_bisect(ys, pos[1])
+        if i==len(ys)-1 and i>0 and pos[1]==ys[i]: #bottom edge
+            i-=1
+        if i<0 or i>=len(self._hit_bands):
+            return None
+        xs,entries=self._hit_bands[i]
+        j=_bisect(xs, pos[0])
+        if j<0 or pos[0]>entries[j][0][2]:
+            return None
+        return entries[j]
+
+    def on_touch(self, pos, win, screen):
+        hit=self.hit(pos)
+        if hit is None:
+            return Frame.on_touch(self, pos, win, screen)
+        return hit[1].on_touch(pos, hit[2], screen)
+
+    def walk(self, widget=None):
+        #all widgets below widget (default: the whole tree)
+        for w in (self if widget is None else widget).children():
+            yield w
+            yield from self.walk(w)
+
+    def mem_report(self):
+        #bytes per widget type, measured by rebuilding one instance of each type
+        #(gc.mem_free deltas on the device, tracemalloc on the host)
+        count={}
+        sample={}
+        seen=set() #Vars can be bound to several widgets
+        for w in self.walk():
+            for o in (w,)+tuple(getattr(w, n, None) for n in ('text','value','is_active')):
+                if isinstance(o, (Widget, Var)) and id(o) not in seen:
+                    seen.add(id(o))
+                    name=type(o).__name__
+                    count[name]=count.get(name,0)+1
+                    sample.setdefault(name, o)
+        report={}
+        for name in sorted(count):
+            size=_measure(lambda: _clone(sample[name]))
+            report[name]=(count[name], size, count[name]*size)
+            log.info('{:<12} {:4d} x {:5d} bytes = {:6d} bytes', name, *report[name])
+        log.info('total {} bytes', sum(r[2] for r in report.values()))
+        return report
+
+    def invalidate(self, widget=None):
+        #collect widgets to be redrawn with the next frame
+        #a widget is skipped if an ancestor is already pending, pending descendants are dropped
+        #and overlapping windows are merged into their common ancestor 
+        if widget is None:
+            widget=self
+        if not self.initiated and not self._batch: #no redraw loop yet, draw right away
+            self._update(widget)
+            return
+        dirty=self._dirty
+        p=widget
+        while p is not None:
+            if p in dirty:
+                self.draws_skipped+=1
+                return
+            p=p.parent
+        win=widget.win
+        for w in list(dirty):
+            if self._is_ancestor(widget, w):
+                del dirty[w]
+                self.draws_skipped+=1
+            elif self._overlaps(win, dirty[w]):
+                del dirty[w]
+                self.draws_skipped+=1
+                self.invalidate(self._common_ancestor(widget, w))
+                return
+        dirty[widget]=win
+
+    @staticmethod
+    def _is_ancestor(parent, widget):
+        p=widget.parent
+        while p is not None:
+            if p is parent:
+                return True
+            p=p.parent
+        return False
+
+    def _common_ancestor(self, a, b):
+        p=a
+        while p is not None:
+            if p is b or self._is_ancestor(p, b):
+                return p
+            p=p.parent
+        return self
+
+    @staticmethod
+    def _overlaps(a, b):
+        return a[0]<b[2] and b[0]<a[2] and a[1]<b[3] and b[1]<a[3]
+
+    def batch(self):
+        #context for many changes at once, e.g. a state sync: no frame is drawn inside, the
+        #invalidated widgets are drawn together afterwards
+        #with root.batch():
+        #    for v in vars: v.val=...
+        return _Batch(self)
+
+    def flush(self):
+        #draw all widgets invalidated since the last frame
+        dirty=self._dirty
+        if not dirty or self._batch:
+            return 0
+        self._dirty={}
+        n=0
+        for w in dirty:
+            if w.is_visible: #may have been hidden by a page switch in the meantime
+                self._update(w)
+                n+=1
+        self.frames+=1
+        self.draws+=n
+        return n
+
+    def _update(self, w):
+        #draws an invalidated widget: containers need the screen and their window, other widgets
+        #draw without, so they can repaint only what changed (e.g. the knob of a Slider)
+        if w is self:
+            self.draw()
+        elif self.canvas is None and not w.children():
+            w.draw()
+        else:
+            self.redraw(w)
+
+    async def handle_redraw(self):
+        while self.initiated:
+            self.flush()
+            await asyncio.sleep(1/self.max_fps)
 
     @property
     def focus_window(self):
@@ -681,36 +1692,155 @@ class Tk(display.TFT, Frame):
         self.rect(0,0,w,h,self.get_bg(), self.get_bg())
 
     
-    async def handle_touch(self, freq=20):
-        self.timestamp=time.time()
-        while self.initiated:
-            t,x, y=self.gettouch()
-            if t and self.touch_start is None: #touch_down
-                self.timestamp=time.time()
-                log.debug('touch at ({},{})'.format(x,y))
-                self.touch_start=x,y
-                self.touch_current=x,y
-                self._focus_widget,self._focus_window =self.on_touch((x,y), (0,0,self.width, self.height), self)
-                self.debounce=0                
-            elif t and self.touch_start is not None:#touch_move
+    def set_penirq_pin(self, pin):
+        #wake the touch handling by the PENIRQ line of the touch controller instead of polling
+        if isinstance(pin, int):
+            pin=Pin(pin, mode=Pin.IN, pull=Pin.PULL_UP, handler=self._handle_penirq, trigger=Pin.IRQ_FALLING)
+        else:
+            pin.init(mode=Pin.IN, pull=Pin.PULL_UP, handler=self._handle_penirq, trigger=Pin.IRQ_FALLING)
+        self.touch_penirq=pin
+
+    def _handle_penirq(self, pin):
+        if self._pen_irq is None:
+            self._pen_irq=time.ticks_ms()
+        if not self._touch_session and self.initiated:
+            self._touch_session=True
+            asyncio.get_event_loop().call_soon(self._start_touch_cb)
+
+    def _start_touch_session(self):
+        asyncio.get_event_loop().create_task(self._touch_session_loop())
+
+    async def _touch_session_loop(self):
+        #polls fast from the PENIRQ until touch_linger s after the release
+        fast=1000//self.touch_active_freq
+        self._touch_interval=fast
+        last_touch=time.ticks_ms()
+        try:
+            while self.initiated:
+                now=time.ticks_ms()
+                if self.poll_touch():
+                    last_touch=now
+                elif time.ticks_diff(now, last_touch)>self.touch_linger*1000:
+                    break
+                self._check_standby()
+                await asyncio.sleep(fast/1000)
+        finally:
+            self._touch_session=False
+        if self._pen_irq is not None and self.initiated: #touched again while ending
+            self._touch_session=True
+            self._start_touch_session()
+
+    def touch_stats(self):
+        #actual poll rate since the last call, current interval (None while idle with PENIRQ) and touch latency
+        now=time.ticks_ms()
+        t,polls=self._touch_stats
+        dt=time.ticks_diff(now, t)
+        rate=(self.touch_polls-polls)*1000/dt if dt>0 else 0
+        self._touch_stats=(now, self.touch_polls)
+        return {'poll_rate':rate, 'interval_ms':self._touch_interval, 'latency_ms':self.touch_latency, 
+            'latency_max_ms':self.touch_latency_max}
+
+    def read_touch(self):
+        #median of touch_samples readings, (None,0,0) if they spread more than touch_spread pixels
+        #(light or noisy press)
+        n=self.touch_samples
+        xs=self._touch_xs
+        ys=self._touch_ys
+        if len(xs)!=n:
+            xs=self._touch_xs=[0]*n
+            ys=self._touch_ys=[0]*n
+        for i in range(n):
+            t,x,y=self.gettouch()
+            if not t:
+                return (False,0,0) if i==0 else (None,0,0)
+            xs[i]=x
+            ys[i]=y
+        if n==1:
+            return t,x,y
+        xs.sort()
+        ys.sort()
+        if xs[-1]-xs[0]>self.touch_spread or ys[-1]-ys[0]>self.touch_spread:
+            self.touch_rejected+=1
+            return None,0,0
+        return True,xs[n//2],ys[n//2]
+
+    def poll_touch(self):
+        #reads the touch controller once and dispatches touch, move and release events
+        #moves within the dead band of the widget or without effect on its value are dropped
+        #returns True while touched
+        if self.touch_penirq is not None and self.touch_start is None and self._pen_irq is None:
+            return False #no interrupt, nobody touches: do not bother the touch controller
+        now=time.ticks_ms()
+        t,x, y=self.read_touch()
+        self.touch_polls+=1
+        if t is None: #rejected, keep the state
+            return self.touch_start is not None
+        if t and self.touch_start is None: #touch_down
+            self.timestamp=time.time()
+            self.touch_latency=time.ticks_diff(now, self._last_poll if self._pen_irq is None else self._pen_irq)
+            self.touch_latency_max=max(self.touch_latency, self.touch_latency_max)
+            log.debug('touch at ({},{})', x,y)
+            self.touch_start=x,y
+            self.touch_current=x,y
+            self._focus_widget,self._focus_window =self.on_touch((x,y), (0,0,self.width, self.height), self)
+            self.debounce=0                
+        elif t and self.touch_start is not None:#touch_move
+            w=self.focus_widget
+            cx,cy=self.touch_current
+            if (abs(x-cx)<=w.drag_deadband and abs(y-cy)<=w.drag_deadband) or \
+                    (w.drag_decimate and not w.drag_changes((x,y), self.focus_window)):
+                self.touch_moves_dropped+=1
+            else:
                 self.touch_current=(x,y)
+                self.touch_moves+=1
                 #if self.focus_widget.is_movable: #this is set by the widget at touch_down
                 #self.focus_widget.on_move((x-self.focus_window[0], y-self.focus_window[1]), self.focus_window)
-                self.focus_widget.on_move(self.touch_current, self.focus_window, self)
-            elif not t and self.touch_start is not None:#touch release
-                log.debug('release at ({},{})'.format(*self.touch_current))
-                #self.movable=False
-                self.focus_widget.on_release(self.touch_current, self.focus_window, self)
-                self.touch_start=None
-                self.touch_current=None
-            if time.time()-self.timestamp > self.shutdown_time:
-                self.shutdown()
-            elif time.time()-self.timestamp > self.standby_time:
-                if not self.standby:
-                    self.set_standby()
-            elif self.standby:
-                self.wakeup()
-            await asyncio.sleep(1/freq)  
+                w.on_move(self.touch_current, self.focus_window, self)
+        elif not t and self.touch_start is not None:#touch release
+            log.debug('release at ({},{})', *self.touch_current)
+            #self.movable=False
+            self.focus_widget.on_release(self.touch_current, self.focus_window, self)
+            self.touch_start=None
+            self.touch_current=None
+            self._pen_irq=None
+        if not t and self.touch_start is None:
+            self._pen_irq=None #bounce or released before the poll
+        self._last_poll=now
+        return t
+
+    async def handle_touch(self):
+        #polls fast while touched, slows down to touch_idle_freq after touch_linger seconds without touch
+        #with a PENIRQ pin nothing is polled while idle, the interrupt starts _touch_session_loop
+        self.timestamp=time.time()
+        fast=1000//self.touch_active_freq
+        slow=1000//self.touch_idle_freq
+        self._touch_interval=fast
+        last_touch=self._last_poll=time.ticks_ms()
+        self._touch_stats=(last_touch, self.touch_polls)
+        while self.initiated:
+            if self.touch_penirq is not None:
+                if not self._touch_session:
+                    self._touch_interval=None
+                self._check_standby()
+                await asyncio.sleep(1)
+                continue
+            now=time.ticks_ms()
+            if self.poll_touch():
+                last_touch=now
+                self._touch_interval=fast
+            elif time.ticks_diff(now, last_touch)>self.touch_linger*1000:
+                self._touch_interval=min(slow, self._touch_interval*2)
+            self._check_standby()
+            await asyncio.sleep(self._touch_interval/1000)  
+
+    def _check_standby(self):
+        if time.time()-self.timestamp > self.shutdown_time:
+            self.shutdown()
+        elif time.time()-self.timestamp > self.standby_time:
+            if not self.standby:
+                self.set_standby()
+        elif self.standby:
+            self.wakeup()
 
     def set_standby(self):
         if not self.standby:
@@ -726,9 +1856,17 @@ class Tk(display.TFT, Frame):
             self.standby=False
             log.info('waking from standby')
 
+    def on_shutdown(self, cb):
+        self.shutdown_cbs.append(cb)
+
     def shutdown(self):
         self.set_standby()
         log.info('shutdown ...')
+        for cb in self.shutdown_cbs:
+            try:
+                cb()
+            except Exception as e:
+                log.exception('shutdown callback failed', e)
         if self.wakeup_pin is not None:
             if isinstance(self.wakeup_pin, int):
                 self.wakeup_pin=Pin(self.wakeup_pin)
@@ -766,32 +1904,265 @@ class Tk(display.TFT, Frame):
         if rot is not None:
             super().orient(rot)
             self.rot=rot
+            self._touch_fixed=None
+            self._cur_win=(0,0)+tuple(v-1 for v in self.screensize())
         return self.rot
 
-    def calibrate_touch(self):
-        raise NotImplementedError
-        #todo:calibration
-
-    def gettouch(self,raw=False):
-        
+    def setwin(self, x1, y1, x2, y2):
+        super().setwin(x1, y1, x2, y2)
+        self._cur_win=(int(x1), int(y1), int(x2), int(y2))
+
+    def resetwin(self):
+        super().resetwin()
+        self._cur_win=(0,0)+tuple(v-1 for v in self.screensize())
+
+    def font(self, font, *args, **kwargs):
+        super().font(font, *args, **kwargs)
+        self._font=font
+
+    def text_extent(self, text, fg=None, bg=None):
+        #(width, height) of text in the current font, measured once per text, font and colors
+        key=(text, self._font, self.get_fg() if fg is None else fg, self.get_bg() if bg is None else bg)
+        e=self.text_cache.get(key)
+        if e is None:
+            e=self.text_cache.add(key, self.textWidth(text), self.fontSize()[1])
+        return e[0], e[1]
+
+    def write_ram(self, x1, y1, x2, y2, data):
+        #writes pixels (3 bytes each, row by row) to the display RAM window x1,y1,x2,y2
+        self.tft_writecmddata(0x2A, bytes((x1>>8, x1&0xFF, x2>>8, x2&0xFF)))
+        self.tft_writecmddata(0x2B, bytes((y1>>8, y1&0xFF, y2>>8, y2&0xFF)))
+        self.tft_writecmddata(0x2C, data)
+
+    def cached_text(self, x, y, text):
+        #like text(), but a text drawn before in the same font and colors is written from
+        #text_cache to the display RAM in one window write, without the font rasterizer
+        key=(text, self._font, self.get_fg(), self.get_bg())
+        e=self.text_cache.get(key)
+        w,h=(self.textWidth(text), self.fontSize()[1]) if e is None else (e[0], e[1])
+        x1,y1,x2,y2=self._cur_win
+        x,y=_text_pos(x, y, w, h, self._cur_win)
+        if x<x1 or y<y1 or x+w-1>x2 or y+h-1>y2 or w<=0: #clipped, left to the rasterizer
+            self.text(x-x1, y-y1, text)
+            if e is None:
+                self.text_cache.add(key, w, h)
+            return
+        if e is not None and e[2] is not None:
+            self.write_ram(x, y, x+w-1, y+h-1, e[2])
+            return
+        self.text(x-x1, y-y1, text)
+        buf=None
+        if w*h*3<=self.text_cache.budget//4:
+            buf=self.readScreen(x, y, w, h)
+        self.text_cache.add(key, w, h, buf)
+
+    def set_touch_calibration(self, box=None, matrix=None, rot=None):
+        #box: raw (xmin, xmax, ymin, ymax), matrix: affine (a,b,c,d,e,f) from raw to screen
+        #coordinates in orientation rot (x=a*rx+b*ry+c, y=d*rx+e*ry+f)
+        if box is not None:
+            self.touch_calibration=box
+        self.touch_matrix=matrix
+        self.touch_matrix_rot=self.rot if rot is None else rot
+        self._touch_fixed=None
+
+    def _legacy_touch_matrix(self):
+        #the matrix equivalent to the calibration box in the current orientation
         cal=self.touch_calibration
         res=self.screensize()
+        sx=res[0]/(cal[1]-cal[0])
+        sy=res[1]/(cal[3]-cal[2])
+        mx=(sx,0,-sx*cal[0])
+        my=(0,sy,-sy*cal[2])
+        if self.rot in (display.TFT.PORTRAIT,display.TFT.PORTRAIT_FLIP): 
+            mx,my=my,mx
+        if self.rot in (display.TFT.LANDSCAPE_FLIP,display.TFT.PORTRAIT_FLIP):
+            my=(-my[0],-my[1],res[1]-my[2])
+        return mx+my
+
+    @staticmethod
+    def _rotation(k, w, h):
+        #affine map of screen coordinates when turning the display k times by 90 degree, 
+        #(w,h) is the screen size before turning
+        m=(1,0,0,0,1,0)
+        for i in range(k%4):
+            m=_affine_mul((0,-1,h-1,1,0,0), m)
+            w,h=h,w
+        return m
+
+    def _touch_transform(self):
+        #integer (16 bit fixed point) coefficients for the current orientation
+        if self._touch_fixed is None:
+            if self.touch_matrix is None:
+                m=self._legacy_touch_matrix()
+            else:
+                m=self.touch_matrix
+                if self.touch_matrix_rot!=self.rot:
+                    w,h=self.screensize()
+                    if (self.rot-self.touch_matrix_rot)%2:
+                        w,h=h,w #size in the calibrated orientation
+                    m=_affine_mul(self._rotation(self.rot-self.touch_matrix_rot, w, h), m)
+            self._touch_fixed=tuple(int(v*65536) for v in m[:2])+(int(m[2]*65536)+32768,)+ \
+                tuple(int(v*65536) for v in m[3:5])+(int(m[5]*65536)+32768,)
+        return self._touch_fixed
+
+    def calibrate_touch(self, points=5, path='touch.cal'):
+        #shows points-many (3-5) crosses, the user touches each of them
+        #computes the affine transformation from the raw touch values and stores it in flash
+        w,h=self.screensize()
+        targets=((w//10,h//10),(w*9//10,h//2),(w//10,h*9//10),(w*9//10,h//10),(w//2,h*9//10))[:max(3,min(5,points))]
+        raw=[]
+        for tx,ty in targets:
+            self.resetwin()
+            self.clear(BLACK)
+            self.line(tx-10,ty,tx+10,ty,WHITE)
+            self.line(tx,ty-10,tx,ty+10,WHITE)
+            raw.append(self._read_raw_touch())
+        m=_fit_affine(raw, targets)
+        self.set_touch_calibration(matrix=m)
+        try:
+            with open(path,'w') as f:
+                f.write(' '.join(str(v) for v in (self.rot,)+m))
+        except OSError as e:
+            log.exception('could not save touch calibration', e)
+        self.clear(BLACK)
+        return m
+
+    def load_touch_calibration(self, path='touch.cal'):
+        #rot and the 6 values of the matrix, a missing or broken file keeps the calibration box
+        try:
+            with open(path) as f:
+                v=f.read().split()
+        except OSError:
+            return False
+        try:
+            if len(v)!=7:
+                raise ValueError('{} values instead of 7'.format(len(v)))
+            matrix=tuple(float(x) for x in v[1:7])
+            rot=int(v[0])
+        except ValueError as e:
+            log.warning('touch calibration {} ignored: {}', path, e)
+            return False
+        self.set_touch_calibration(matrix=matrix, rot=rot)
+        return True
+
+    def _shown_menues(self, widget=None):
+        #the Menues of the visible tree, parents first; the active page of a Menue is
+        #read (and built) after the Menue was yielded
+        for w in (self if widget is None else widget).children():
+            if isinstance(w, Menue):
+                yield w
+                page=w.pages[w.active]
+                page.build()
+                yield from self._shown_menues(page)
+            else:
+                yield from self._shown_menues(w)
+
+    def save_state(self, vars, path='ui.state'):
+        #the active pages, the values of vars (name -> Var) and the backlight, in rtc memory
+        #(kept during deep sleep) and in path on flash (kept without power, skipped if None)
+        backlight=None
+        if hasattr(self, '_backl'):
+            backlight=self._backlight if self.standby else self.backlight()
+        state=json.dumps({'pages':[m.active for m in self._shown_menues()],
+            'vars':{k:v.val for k,v in vars.items()}, 'backlight':backlight})
+        RTC().write_string(state)
+        if path is not None:
+            with open(path, 'w') as f:
+                f.write(state)
+        log.info('saved ui state')
+
+    def restore_state(self, vars, path='ui.state'):
+        #counterpart of save_state, to be called before the first draw
+        #the RTC memory first, the file if it is empty or does not parse (e.g. cut short by a reset)
+        state=self._parse_state(RTC().read_string())
+        if state is None and path is not None:
+            try:
+                with open(path) as f:
+                    state=self._parse_state(f.read())
+            except OSError:
+                pass
+        if state is None:
+            return False
+        pages=state.get('pages', [])
+        for i,m in enumerate(self._shown_menues()):
+            if i>=len(pages):
+                break
+            if pages[i]<len(m.pages):
+                m.active=pages[i]
+        with self.batch():
+            for k,val in state.get('vars', {}).items():
+                if k in vars:
+                    vars[k].val=val
+        if state.get('backlight') is not None and hasattr(self, '_backl'):
+            self._backlight=state['backlight']
+            self.backlight(self._backlight)
+        log.info('restored ui state')
+        return True
+
+    @staticmethod
+    def _parse_state(state):
+        #the dict of a saved state, None if there is none
+        try:
+            state=json.loads(state)
+        except ValueError:
+            return None
+        return state if isinstance(state, dict) else None
+
+    def _read_raw_touch(self, samples=8):
+        #average of the raw values while touched, blocks until touched and released
+        sx=sy=n=0
+        while n<samples:
+            t,y,x=super().gettouch(raw=True)
+            if t:
+                sx+=x
+                sy+=y
+                n+=1
+            time.sleep_ms(20)
+        while super().gettouch(raw=True)[0]:
+            time.sleep_ms(20)
+        return (sx/n, sy/n)
+
+    def gettouch(self,raw=False):
         t,y,x=super().gettouch(raw=True)
         if raw:
             return(t,x,y)
-        if not t or x<cal[0] or x>cal[1] or y<cal[2] or y>cal[3]: #maybe better return extremes
+        if not t:
+            return False,0,0
+        a,b,c,d,e,f=self._touch_fixed or self._touch_transform()
+        sx=(a*x+b*y+c)>>16
+        sy=(d*x+e*y+f)>>16
+        w,h=self.screensize()
+        if sx<0 or sy<0 or sx>w or sy>h: #outside of the calibrated area
             return False,0,0
-        #do calibration
-        x=((x-cal[0])/(cal[1]-cal[0]))*res[0]
-        y=((y-cal[2])/(cal[3]-cal[2]))*res[1]
-        if self.orient() in [display.TFT.PORTRAIT,display.TFT.PORTRAIT_FLIP]: 
-            (x,y)=(y,x)
-        if self.orient() in [display.TFT.LANDSCAPE_FLIP,display.TFT.PORTRAIT_FLIP]:
-            y=res[1]-y
-        return(t,int(x),int(y))
-
-    def draw(self):
-        super().draw(self, (0,0,self.width, self.height) )
+        return(t,sx,sy)
+
+    @property
+    def device(self):
+        return self
+
+    def set_compositing(self, strip_height=16):
+        #draw through an off-screen buffer of strip_height screen rows (3*strip_height*width bytes),
+        #higher strips need more RAM but fewer window writes, 0 draws directly to the display
+        self.canvas=Canvas(self, strip_height) if strip_height else None
+
+    def redraw(self, widget, win=None):
+        #full draw of widget, through the canvas if compositing
+        if win is None:
+            win=widget.win
+        if self.canvas is None:
+            widget.draw(self, win)
+        else:
+            self.canvas.render(widget, win)
+
+    def draw(self, screen=None, win=None):
+        if screen is None:
+            self.layout_changed()
+            win=(0,0,self.width, self.height)
+            if self.canvas is not None:
+                self.canvas.render(self, win)
+                return
+            screen=self
+        super().draw(screen, win)
     #    if self.focus_window is not None:
     #        self.rect(*self.focus_window, color=RED)
     
@@ -16,9 +16,9 @@ class Battery:
 
     def update(self):
         self.vbat=self.pin.read()/4095*3.9*2
-        log.info("battery is at {} Volts".format(self.vbat))
+        log.info("battery is at {} Volts", self.vbat)
 
-    def mainloop(self):
+    async def mainloop(self):
         while self._interval is not None:
             self.update()
             await asyncio.sleep(self._interval)
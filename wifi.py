@@ -0,0 +1,169 @@
+# wifi connection manager, runs as uasyncio task so the gui keeps running while connecting
+# the last network (ssid, bssid, channel, ip config) is kept in cache_path; it is tried first
+# (with its bssid, optionally with the old ip config instead of dhcp), then the known networks
+# of credentials.txt (ssid<space>password per line) are tried in the order of their signal strength
+# reuse_ip is for networks with a reserved address only: the old ip config is not renewed like a
+# dhcp lease, it falls back to dhcp only if the cached network does not connect
+# the scan blocks the whole loop for about 2 s, so prescan() does it before the loop starts when
+# the cached network cannot be used
+try:
+    import ujson as json
+except ImportError:
+    import json
+try:
+    import ubinascii as binascii
+except ImportError:
+    import binascii
+import time
+import network
+import uasyncio as asyncio
+from log import log
+
+
+class WifiManager:
+    def __init__(self, credentials='credentials.txt', cache_path='wifi.cache', timeout=10, fast_timeout=4, reuse_ip=False):
+        self.sta=network.WLAN(network.STA_IF)
+        self.credentials=credentials
+        self.cache_path=cache_path
+        self.timeout=timeout #s per network
+        self.fast_timeout=fast_timeout #s for the cached network
+        self.reuse_ip=reuse_ip #skip dhcp with the cached ip config
+        self.connect_cbs=[]
+        self.ssid=None
+        self.attempts=0
+        self.connects=0
+        self.fast_connects=0 #connects to the cached network without scan
+        self.failures=0 #connect() calls without a connection
+        self.scans=0
+        self.found=None #result of a scan not used by connect() yet
+        self.last_ms=None #duration of the last successful connect()
+        self.max_ms=0
+        self.total_ms=0
+
+    def on_connect(self, cb):
+        self.connect_cbs.append(cb)
+
+    def _read_credentials(self):
+        networks={}
+        try:
+            with open(self.credentials) as f:
+                for line in f:
+                    line=line.strip().split()
+                    if line:
+                        networks[line[0]]=line[1] if len(line)>1 else ''
+        except OSError:
+            log.error('no wifi credentials in {}', self.credentials)
+        return networks
+
+    def _load_cache(self):
+        try:
+            with open(self.cache_path) as f:
+                return json.loads(f.read())
+        except (OSError, ValueError):
+            return None
+
+    def _save_cache(self, ssid, bssid, channel):
+        cache=dict(ssid=ssid, bssid=bssid, channel=channel, ifconfig=list(self.sta.ifconfig()))
+        if cache!=self._load_cache(): #spare the flash
+            with open(self.cache_path, 'w') as f:
+                f.write(json.dumps(cache))
+
+    def scan(self):
+        #known networks in range as (ssid, bssid hex, channel, rssi), strongest first
+        #blocks for the scan (about 2 s), the loop included
+        self.sta.active(True)
+        known=self._read_credentials()
+        self.scans+=1
+        found=[]
+        for n in self.sta.scan():
+            ssid=n[0].decode() if isinstance(n[0], bytes) else n[0]
+            if ssid in known:
+                found.append((ssid, binascii.hexlify(n[1]).decode(), n[2], n[3]))
+        found.sort(key=lambda n: -n[3])
+        self.found=found
+        return found
+
+    def prescan(self):
+        #to be called before the loop starts: scans if there is no known cached network to try first
+        cache=self._load_cache()
+        if cache is None or cache.get('ssid') not in self._read_credentials():
+            self.scan()
+
+    async def _try(self, ssid, password, bssid, timeout):
+        self.attempts+=1
+        log.info('connecting to {}', ssid)
+        if bssid is not None:
+            self.sta.connect(ssid, password, bssid=binascii.unhexlify(bssid))
+        else:
+            self.sta.connect(ssid, password)
+        start=time.ticks_ms()
+        while not self.sta.isconnected():
+            if time.ticks_diff(time.ticks_ms(), start)>timeout*1000:
+                self.sta.disconnect()
+                log.info('no connection to {} within {} s', ssid, timeout)
+                return False
+            await asyncio.sleep(.05)
+        return True
+
+    async def connect(self):
+        #returns the ssid of the connected network or None
+        self.sta.active(True)
+        if self.sta.isconnected():
+            return self.ssid
+        start=time.ticks_ms()
+        known=self._read_credentials()
+        ok=False
+        failed=None
+        cache=self._load_cache()
+        if cache is not None and cache.get('ssid') in known:
+            ssid=cache['ssid']
+            if self.reuse_ip and cache.get('ifconfig'):
+                self.sta.ifconfig(tuple(cache['ifconfig']))
+            ok=await self._try(ssid, known[ssid], cache.get('bssid'), self.fast_timeout)
+            if ok:
+                self.fast_connects+=1
+                bssid,channel=cache.get('bssid'), cache.get('channel')
+            else:
+                failed=cache.get('bssid')
+                if self.reuse_ip:
+                    self.sta.ifconfig('dhcp')
+        if not ok:
+            found,self.found=self.found,None
+            if found is None:
+                await asyncio.sleep(0) #pending redraws and input first
+                found=self.scan()
+            for ssid,bssid,channel,rssi in found:
+                if bssid==failed: #tried just now
+                    continue
+                if await self._try(ssid, known[ssid], bssid, self.timeout):
+                    ok=True
+                    break
+        ms=time.ticks_diff(time.ticks_ms(), start)
+        if not ok:
+            self.failures+=1
+            log.warning('no wifi connection after {} ms', ms)
+            return None
+        self.ssid=ssid
+        self.connects+=1
+        self.last_ms=ms
+        self.max_ms=max(self.max_ms, ms)
+        self.total_ms+=ms
+        log.info('connected to wifi {} in {} ms; ip is {}', ssid, ms, self.sta.ifconfig()[0])
+        self._save_cache(ssid, bssid, channel)
+        for cb in self.connect_cbs:
+            cb()
+        return ssid
+
+    async def keep_connected(self, interval=5, retry=30):
+        #connects and reconnects after losing the connection, retry s after a failed attempt
+        while True:
+            if not self.sta.isconnected():
+                if await self.connect() is None:
+                    await asyncio.sleep(retry)
+                    continue
+            await asyncio.sleep(interval)
+
+    def stats(self):
+        return {'ssid':self.ssid, 'attempts':self.attempts, 'connects':self.connects, 'fast_connects':self.fast_connects,
+            'failures':self.failures, 'scans':self.scans, 'last_ms':self.last_ms, 'max_ms':self.max_ms,
+            'avg_ms':self.total_ms//self.connects if self.connects else None}